@@ -0,0 +1,57 @@
+import hashlib
+import os
+import threading
+from flask import request
+
+# A year, the longest lifetime caches are asked to honour.
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Content hashes of static files keyed by app, filename and modification
+# time, so an edited file gets a new URL without restarting the app.
+_hashes = {}
+_lock = threading.Lock()
+
+
+def staticHash(app, filename):
+    """
+    This returns a short hash of a static file's contents, or None if the
+    file does not exist.
+    """
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    key = (app.import_name, filename, mtime)
+    with _lock:
+        digest = _hashes.get(key)
+    if digest is None:
+        with open(path, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()[:12]
+        with _lock:
+            _hashes[key] = digest
+    return digest
+
+
+def init_app(app):
+    """
+    This adds a ?v=<content hash> to every url_for('static', ...) URL and
+    lets clients cache responses for such URLs for a year, since a changed
+    file gets a different URL.
+    """
+    @app.url_defaults
+    def fingerprintStatic(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and \
+                'v' not in values:
+            digest = staticHash(app, values['filename'])
+            if digest:
+                values['v'] = digest
+
+    @app.after_request
+    def cacheFingerprinted(response):
+        if request.endpoint == 'static' and response.status_code == 200 \
+                and request.args.get('v') == \
+                staticHash(app, request.view_args.get('filename', '')):
+            response.headers['Cache-Control'] = \
+                'public, max-age=%d, immutable' % STATIC_MAX_AGE
+        return response
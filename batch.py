@@ -0,0 +1,242 @@
+import os
+import string
+from sqlalchemy import and_, or_
+from cache import getCategoryMap
+from database_setup import Item
+from slugs import slugify, uniqueSlug
+
+# The most items one batch request may read or write.
+MAX_BATCH_SIZE = int(os.environ.get('CATALOG_MAX_BATCH_SIZE', 100))
+
+_text = type(u'')
+
+
+class BatchError(ValueError):
+    """
+    An operation in a batch that cannot be applied.  status is the HTTP
+    status reported for that operation.
+    """
+
+    def __init__(self, status, message):
+        ValueError.__init__(self, message)
+        self.status = status
+
+
+def findCategoryId(key):
+    if key is None:
+        raise BatchError(400, 'category is required')
+    category = getCategoryMap().get(_text(key))
+    if category is None:
+        raise BatchError(404, 'no such category: %s' % key)
+    return category.id
+
+
+def itemKey(entry):
+    """
+    This returns the key an API request names an item by: ('id', 12) for
+    {"id": 12} and ('slug', (category_id, slug)) for
+    {"category": "dog", "slug": "labrador-retriever"}, where the category is
+    a slug or an id.
+    """
+    if entry.get('id') is not None:
+        try:
+            return 'id', int(entry['id'])
+        except (TypeError, ValueError):
+            raise BatchError(400, 'id must be a number')
+    if entry.get('category') is None or \
+            not isinstance(entry.get('slug'), _text):
+        raise BatchError(400, 'give an id, or a category and a slug')
+    return 'slug', (findCategoryId(entry['category']), entry['slug'])
+
+
+def parseKeys(ids, slugs):
+    """
+    This returns the item keys named by the ?ids=1,2 and
+    ?slugs=dog/labrador-retriever,cat/siamese arguments of a multi-get, each
+    paired with the value that named it.
+    """
+    keys = []
+    for value in filter(None, (ids or '').split(',')):
+        keys.append((itemKey({'id': value}), value))
+    for value in filter(None, (slugs or '').split(',')):
+        category, _, slug = value.partition('/')
+        keys.append((itemKey({'category': category, 'slug': slug}), value))
+    return keys
+
+
+def loadItems(query, keys):
+    """
+    This looks up the items named by keys with a single query and returns
+    them keyed by both their id key and their slug key.  query selects Item
+    objects or rows with at least id, category_id and slug.
+    """
+    ids = [value for kind, value in keys if kind == 'id']
+    criteria = [and_(Item.category_id == category_id, Item.slug == slug)
+                for kind, (category_id, slug) in
+                [key for key in keys if key[0] == 'slug']]
+    if ids:
+        criteria.append(Item.id.in_(ids))
+    found = {}
+    if criteria:
+        for item in query.filter(or_(*criteria)):
+            found[('id', item.id)] = item
+            found[('slug', (item.category_id, item.slug))] = item
+    return found
+
+
+def takenNames(session, pairs):
+    """
+    This returns which of the (category_id, name) pairs are already used,
+    mapped to the id of the item using them.
+    """
+    if not pairs:
+        return {}
+    query = session.query(Item.category_id, Item.name, Item.id).filter(or_(
+        *[and_(Item.category_id == category_id, Item.name == name)
+          for category_id, name in pairs]))
+    return dict(((category_id, name), item_id)
+                for category_id, name, item_id in query)
+
+
+def takenItemSlugs(session, bases):
+    """
+    This returns the slugs uniqueSlug could collide with for each
+    (category_id, base) pair, as a set of slugs per category id, looked up
+    with one query.
+    """
+    taken = dict((category_id, set()) for category_id, base in bases)
+    if not bases:
+        return taken
+    query = session.query(Item.category_id, Item.slug).filter(or_(
+        *[and_(Item.category_id == category_id,
+               or_(Item.slug == base, Item.slug.like(base + '-%')))
+          for category_id, base in bases]))
+    for category_id, slug in query:
+        taken[category_id].add(slug)
+    return taken
+
+
+def itemName(entry, required):
+    name = entry.get('name')
+    if name is None and not required:
+        return None
+    if not isinstance(name, _text) or not name.strip():
+        raise BatchError(400, 'name must be a non-empty string')
+    name = string.capwords(name)
+    if len(name) > Item.__table__.c.name.type.length:
+        raise BatchError(400, 'name is too long')
+    return name
+
+
+def itemDescription(entry):
+    description = entry.get('description')
+    length = Item.__table__.c.description.type.length
+    if description is not None and (
+            not isinstance(description, _text) or len(description) > length):
+        raise BatchError(400, 'description must be a string of at most '
+                              '%d characters' % length)
+    return description
+
+
+def applyBatch(session, operations, user_id):
+    """
+    This stages the create, update and delete operations of a batch request
+    in session for user_id and returns a result per operation together with
+    the (item, action) pairs to commit.  The items to change are loaded
+    with one query and ownership is checked for all of them at once; name
+    clashes and the slugs already in use are found with one more query
+    each.  Operations that cannot be
+    applied get an error result and are left out of the commit.
+    """
+    results = [None] * len(operations)
+    parsed = []
+    for index, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict):
+                raise BatchError(400, 'operations must be objects')
+            action = operation.get('action')
+            if action == 'create':
+                key = None
+                category_id = findCategoryId(operation.get('category'))
+                name = itemName(operation, required=True)
+            elif action in ('update', 'delete'):
+                key = itemKey(operation)
+                category_id = None
+                name = itemName(operation, required=False) \
+                    if action == 'update' else None
+            else:
+                raise BatchError(400, 'action must be create, update or '
+                                      'delete')
+            description = itemDescription(operation)
+        except BatchError as e:
+            results[index] = {'status': e.status, 'error': e.args[0]}
+            continue
+        parsed.append((index, action, key, category_id, name, description))
+
+    items = loadItems(session.query(Item),
+                      [item_key for _, _, item_key, _, _, _ in parsed
+                       if item_key])
+    not_owned = set(item.id for item in items.values()
+                    if item.user_id != user_id)
+    pairs, bases = set(), set()
+    for index, action, key, category_id, name, description in parsed:
+        if name is not None:
+            if key is not None and key in items:
+                category_id = items[key].category_id
+            if category_id is not None:
+                pairs.add((category_id, name))
+                bases.add((category_id, slugify(name, 'item')))
+    names = takenNames(session, pairs)
+    slugs = takenItemSlugs(session, bases)
+
+    changes, touched = [], set()
+    for index, action, key, category_id, name, description in parsed:
+        item = items.get(key) if key else None
+        try:
+            if key and item is None:
+                raise BatchError(404, 'no such item')
+            if item is not None:
+                if item.id in not_owned:
+                    raise BatchError(403, 'item belongs to another user')
+                if item.id in touched:
+                    raise BatchError(409, 'item appears more than once')
+                category_id = item.category_id
+            if name is not None and (item is None or name != item.name):
+                if names.get((category_id, name), -1) not in \
+                        (-1, getattr(item, 'id', None)):
+                    raise BatchError(409, 'name already used in category')
+                names[(category_id, name)] = getattr(item, 'id', 0)
+        except BatchError as e:
+            results[index] = {'status': e.status, 'error': e.args[0]}
+            continue
+
+        if action == 'create':
+            item = Item(name=name, description=description,
+                        category_id=category_id, user_id=user_id)
+            session.add(item)
+        elif action == 'delete':
+            session.delete(item)
+        else:
+            if description is not None:
+                item.description = description
+            if name is None or name == item.name:
+                name = None
+            else:
+                item.name = name
+        if action == 'create' or name is not None:
+            # Slugs given out earlier in this batch are not flushed yet, so
+            # they are added to the category's set as they are given out.
+            # A renamed item's old slug stays taken until the commit.
+            taken = slugs[category_id]
+            base = slugify(name, 'item')
+            if item.id is not None:
+                item.slug = uniqueSlug(base, taken - set([item.slug]))
+            else:
+                item.slug = uniqueSlug(base, taken)
+            taken.add(item.slug)
+        if item.id is not None:
+            touched.add(item.id)
+        changes.append((item, action))
+        results[index] = {'status': 201 if action == 'create' else 200,
+                          'Item': item if action != 'delete' else None}
+    return results, changes
@@ -0,0 +1,117 @@
+"""
+Generates a synthetic catalog for the benchmarks.
+
+    python -m benchmarks.dataset --categories 50 --items 100000 --users 1000
+    python -m benchmarks.dataset --items 1000000 --skew 1.1
+
+With --skew, category sizes and the number of items each user owns follow a
+Zipf-like distribution (the k-th category gets weight 1/k**skew), so a few
+large categories and prolific users dominate, as they do in production.
+
+The target database is taken from CATALOG_DATABASE_URL and is upgraded to the
+current schema before any rows are written.
+"""
+import argparse
+import bisect
+import random
+from datetime import datetime, timedelta
+
+from database import get_engine
+from database_setup import User, Category, Item
+from migrations import upgrade
+from search import rebuildSearchIndex
+
+BATCH_SIZE = 5000
+WORDS = ('small', 'large', 'friendly', 'loyal', 'playful', 'quiet', 'active',
+         'hardy', 'gentle', 'curious', 'fluffy', 'sleek', 'spotted',
+         'striped', 'brown', 'black', 'white', 'golden', 'grey', 'young',
+         'old', 'rare', 'common', 'working', 'hunting', 'herding', 'family',
+         'companion', 'coat', 'tail', 'ears', 'eyes', 'muzzle', 'paws')
+
+
+def insertBatches(conn, table, rows):
+    """
+    This inserts rows, which may be a generator, BATCH_SIZE at a time so
+    large catalogs are never held in memory at once.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+
+
+def weightedPicker(rng, count, skew):
+    """
+    This returns a function picking a number from 1 to count, uniformly when
+    skew is 0 and with probability proportional to 1/k**skew otherwise.
+    """
+    if not skew:
+        return lambda: rng.randint(1, count)
+    totals, total = [], 0.0
+    for k in range(1, count + 1):
+        total += 1.0 / k ** skew
+        totals.append(total)
+    return lambda: bisect.bisect_left(totals, rng.random() * total) + 1
+
+
+def generate(bind=None, categories=50, items=100000, users=1000, seed=0,
+             skew=0.0):
+    """
+    This fills an empty database with the given number of categories, items
+    and users.  Items are spread over the categories and owners according to
+    skew and evenly over the last year.
+    """
+    bind = bind or get_engine()
+    upgrade(bind)
+    rng = random.Random(seed)
+    pickCategory = weightedPicker(rng, categories, skew)
+    pickUser = weightedPicker(rng, users, skew)
+    now = datetime.now()
+    with bind.begin() as conn:
+        insertBatches(conn, User.__table__, (
+            {'id': n, 'name': 'User %d' % n,
+             'email': 'user%d@example.com' % n}
+            for n in range(1, users + 1)))
+        insertBatches(conn, Category.__table__, (
+            {'id': n, 'name': 'Category %d' % n, 'slug': 'category-%d' % n}
+            for n in range(1, categories + 1)))
+        insertBatches(conn, Item.__table__, (
+            {'id': n, 'name': 'Item %d' % n, 'slug': 'item-%d' % n,
+             'description': 'Item %d is %s.' % (
+                 n, ' '.join(rng.sample(WORDS, 6))),
+             'time': now - timedelta(seconds=rng.randint(0, 365 * 86400)),
+             'user_id': pickUser(),
+             'category_id': pickCategory()}
+            for n in range(1, items + 1)))
+        rebuildSearchIndex(conn)
+        if bind.dialect.name == 'postgresql':
+            # Resync the id sequences after inserting explicit ids.
+            for table in ('user', 'category', 'item'):
+                conn.execute("SELECT setval(pg_get_serial_sequence('\"%s\"', "
+                             "'id'), (SELECT MAX(id) FROM \"%s\"))"
+                             % (table, table))
+        conn.execute('ANALYZE')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--skew', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(categories=args.categories, items=args.items, users=args.users,
+             seed=args.seed, skew=args.skew)
+    print('Generated %d categories, %d items and %d users'
+          % (args.categories, args.items, args.users))
+
+
+if __name__ == '__main__':
+    main()
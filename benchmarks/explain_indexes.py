@@ -0,0 +1,140 @@
+"""
+Checks that the queries the main routes issue are answered from indexes.
+
+    python -m benchmarks.explain_indexes --items 200000
+
+A synthetic catalog is generated first unless --no-generate is given.  The
+read routes are then requested through the app and every SELECT they send
+is recorded with its parameters, including the keyset ORDER BY ... LIMIT of
+the category pages.  Each recorded statement is run through EXPLAIN
+(Postgres) or EXPLAIN QUERY PLAN (SQLite) with the planner's defaults, so
+the plans are the ones the planner picks on this data.  The script exits
+non-zero if any of them reads the item table with a sequential scan; small
+tables such as category may be scanned, since that is cheaper there.
+"""
+import argparse
+import json
+import sys
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import get_engine
+from benchmarks.dataset import generate
+
+# The tables that must never be read in full.
+LARGE_TABLES = ('item',)
+
+
+def routePaths(client, category, item):
+    """
+    This returns the read routes to check, including a second category
+    page so the keyset seek is covered as well as the first page.
+    """
+    page = json.loads(client.get('/catalog/%s/JSON?limit=20' % category)
+                      .get_data().decode('utf-8'))
+    paths = [
+        '/',
+        '/catalog/%s/' % category,
+        '/catalog/%s/JSON' % category,
+        '/catalog/%s/%s/' % (category, item),
+        '/catalog/%s/%s/JSON' % (category, item),
+        '/search/?q=loyal',
+        '/search/JSON?q=loyal+hardy',
+    ]
+    if page.get('next'):
+        paths.append('/catalog/%s/JSON?limit=20&cursor=%s'
+                     % (category, page['next']))
+    return paths
+
+
+def captureStatements(app, paths):
+    """
+    This requests each path and returns the distinct SELECT statements sent
+    to the database, each with the path that first sent it and its
+    parameters.
+    """
+    captured, seen = [], set()
+    current = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and \
+                statement not in seen:
+            seen.add(statement)
+            captured.append((current['path'], statement, parameters))
+
+    client = app.test_client()
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        for path in paths:
+            current['path'] = path
+            status = client.get(path).status_code
+            if status != 200:
+                print('%s returned %d' % (path, status))
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+    return captured
+
+
+def planTable(line):
+    # "SCAN item ..." or, from older SQLite versions, "SCAN TABLE item ...".
+    words = line.split()
+    return words[2] if len(words) > 2 and words[1] == 'TABLE' else words[1]
+
+
+def explain(conn, statement, parameters):
+    """
+    This returns the query plan as a list of lines and whether every access
+    to a large table in it goes through an index.
+    """
+    if conn.dialect.name == 'sqlite':
+        lines = [row[-1] for row in
+                 conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        indexed = all('USING' in line or 'VIRTUAL TABLE' in line
+                      for line in lines
+                      if line.startswith(('SCAN', 'SEARCH')) and
+                      planTable(line) in LARGE_TABLES)
+    else:
+        lines = [row[0] for row in
+                 conn.execute('EXPLAIN ' + statement, parameters)]
+        indexed = not any(('Seq Scan on %s ' % table) in (line + ' ')
+                          for line in lines for table in LARGE_TABLES)
+    return lines, indexed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--items', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--no-generate', action='store_true',
+                        help='explain against the existing data')
+    args = parser.parse_args()
+    if not args.no_generate:
+        generate(categories=args.categories, items=args.items,
+                 users=args.users)
+
+    from project import create_app
+    app = create_app()
+    engine = get_engine()
+    with engine.connect() as conn:
+        category, item = conn.execute(
+            'SELECT category.slug, item.slug FROM item JOIN category '
+            'ON category.id = item.category_id ORDER BY item.id '
+            'LIMIT 1').first()
+    statements = captureStatements(
+        app, routePaths(app.test_client(), category, item))
+    failures = 0
+    with engine.connect() as conn:
+        for path, statement, parameters in statements:
+            lines, indexed = explain(conn, statement, parameters)
+            print('%s %s: %s' % ('ok  ' if indexed else 'SCAN', path,
+                                 ' '.join(statement.split())[:100]))
+            for line in lines:
+                print('       %s' % line)
+            failures += not indexed
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Measures how request throughput scales with the number of worker threads
+when every thread uses its own scoped session from the connection pool.
+
+    python -m benchmarks.pool_throughput --threads 1,2,4,8,16 --requests 2000
+
+Point CATALOG_DATABASE_URL at a local database before running it.
+"""
+import argparse
+import threading
+import time
+
+from sqlalchemy import desc
+
+from database import DBSession, get_engine
+from database_setup import Category, Item
+
+
+def simulated_request():
+    """
+    This runs the same queries as the home page and then releases the
+    session, the way the teardown handler does at the end of a request.
+    """
+    session = DBSession()
+    try:
+        session.query(Category).all()
+        session.query(Item).order_by(desc(Item.time)).limit(5).all()
+    finally:
+        DBSession.remove()
+
+
+def run(threads, requests_per_run):
+    """
+    This spreads requests_per_run simulated requests over the given number
+    of threads and returns the achieved requests per second.
+    """
+    per_thread = max(1, requests_per_run // threads)
+
+    def worker():
+        for _ in range(per_thread):
+            simulated_request()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--threads', default='1,2,4,8,16',
+                        help='comma separated thread counts to try')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='simulated requests per thread count')
+    args = parser.parse_args()
+
+    # Warm the pool so the first run does not pay for opening connections.
+    simulated_request()
+    baseline = None
+    print('%8s %12s %8s' % ('threads', 'req/s', 'speedup'))
+    for threads in [int(n) for n in args.threads.split(',')]:
+        rate = run(threads, args.requests)
+        baseline = baseline or rate
+        print('%8d %12.1f %7.2fx' % (threads, rate, rate / baseline))
+    print('pool: %s' % get_engine().pool.status())
+
+
+if __name__ == '__main__':
+    main()
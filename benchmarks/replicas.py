@@ -0,0 +1,119 @@
+"""
+Checks read replica routing locally with SQLite files standing in for the
+primary and its replicas.
+
+    python -m benchmarks.replicas --dir /tmp/replicas --replicas 2
+    python -m benchmarks.replicas --selection least_loaded
+
+A small synthetic catalog is written to primary.db, in a new temporary
+directory unless --dir is given, and copied to each replica file, plus one
+replica URL that cannot be opened.  The script then reports which database
+served the read only views, that the broken replica was skipped, that a
+user sees their own new item straight away although the replica copies
+never get it, and that anonymous reads go back to the replicas once the
+read-your-writes window has passed.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+WINDOW = 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', help='where to write the SQLite files '
+                                      '(default: a new temporary directory)')
+    parser.add_argument('--replicas', type=int, default=2)
+    parser.add_argument('--selection', default='round_robin',
+                        choices=['round_robin', 'least_loaded'])
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    from benchmarks.dataset import generate
+    from database import make_engine
+    from project import create_app
+
+    if args.dir is None:
+        args.dir = tempfile.mkdtemp(prefix='replica_check')
+    elif not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+    primary = os.path.abspath(os.path.join(args.dir, 'primary.db'))
+    if os.path.exists(primary):
+        os.remove(primary)
+    generate(make_engine('sqlite:///' + primary), categories=3, items=30,
+             users=2)
+    replica_urls = []
+    for n in range(args.replicas):
+        path = os.path.abspath(os.path.join(args.dir, 'replica%d.db' % n))
+        shutil.copy(primary, path)
+        replica_urls.append('sqlite:///' + path)
+    replica_urls.append('sqlite:///' + os.path.join(
+        os.path.abspath(args.dir), 'missing', 'replica.db'))
+
+    app = create_app({'DATABASE_URL': 'sqlite:///' + primary,
+                      'REPLICA_URLS': replica_urls,
+                      'REPLICA_SELECTION': args.selection,
+                      'READ_YOUR_WRITES_SECONDS': WINDOW})
+    served = Counter()
+    local = threading.local()
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def recordDatabase(conn, *arguments):
+        if getattr(local, 'counting', False):
+            served[os.path.basename(conn.engine.url.database)] += 1
+
+    def reads(client, paths):
+        served.clear()
+        local.counting = True
+        statuses = Counter(client.get(path).status_code for path in paths)
+        local.counting = False
+        return statuses, dict(served)
+
+    anonymous = app.test_client()
+    paths = ['/catalog/category-%d/JSON' % (n % 3 + 1)
+             for n in range(args.requests)]
+    statuses, databases = reads(anonymous, paths)
+    print('anonymous reads: %s, statements by database: %s'
+          % (dict(statuses), databases))
+    failures = 0
+    if 'primary.db' in databases or 'replica.db' in databases:
+        print('FAIL: reads did not all go to the healthy replicas')
+        failures += 1
+
+    writer = app.test_client()
+    with writer.session_transaction() as login_session:
+        login_session['user_id'] = 1
+    writer.post('/catalog/category-1/add/',
+                data={'name': 'Replica Check', 'description': 'New.'})
+    statuses, databases = reads(writer,
+                                ['/catalog/category-1/replica-check/JSON'])
+    print('writer reading its new item: %s, statements by database: %s'
+          % (dict(statuses), databases))
+    if statuses != Counter({200: 1}):
+        print('FAIL: the writer did not see its own write')
+        failures += 1
+
+    time.sleep(WINDOW + 0.1)
+    statuses, databases = reads(anonymous,
+                                ['/catalog/category-1/replica-check/JSON'])
+    print('anonymous read after the window: %s, statements by database: %s'
+          % (dict(statuses), databases))
+    if 'primary.db' in databases:
+        print('FAIL: reads stayed on the primary after the window')
+        failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,401 @@
+"""
+Drives every route in project.py under concurrent load and reports latency
+percentiles, throughput and SQL statement counts per route.
+
+    python -m benchmarks.routes --sqlite /tmp/bench.db --generate \\
+        --items 100000 --skew 1.1 --concurrency 8 --requests 400 \\
+        --save baseline.json
+    python -m benchmarks.routes --sqlite /tmp/bench.db --compare baseline.json
+
+Without --sqlite the database named by CATALOG_DATABASE_URL is used, so the
+same run can target a local Postgres.  Requests go through the Flask test
+client by default, or through a local threaded WSGI server with --server.
+--oauth also benchmarks /gconnect and /gdisconnect against the local stub
+OAuth server.  --save writes the results as JSON and --compare diffs a run
+against a saved baseline, exiting non-zero when a route's p95 latency
+regressed by more than --max-regression.  Query budgets are enforced, and a
+run in which any request failed exits non-zero without saving its results.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = int(round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class TestClient(object):
+    """
+    This sends requests through Flask's test client.
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, values):
+        with self.client.session_transaction() as login_session:
+            login_session.clear()
+            login_session.update(values)
+
+    def request(self, method, url, data=None):
+        response = self.client.open(url, method=method, data=data)
+        response.get_data()
+        return response.status_code, \
+            int(response.headers.get('X-Query-Count', 0))
+
+
+class ServerClient(object):
+    """
+    This sends requests over HTTP to a local WSGI server.  Logins are made
+    by signing a session cookie with the app's secret key.
+    """
+
+    def __init__(self, app, base_url):
+        import requests
+        self.app = app
+        self.base_url = base_url
+        self.http = requests.Session()
+
+    def login(self, values):
+        serializer = self.app.session_interface.get_signing_serializer(
+            self.app)
+        self.http.cookies.set(self.app.config['SESSION_COOKIE_NAME'],
+                              serializer.dumps(dict(values)))
+
+    def request(self, method, url, data=None):
+        response = self.http.request(method, self.base_url + url, data=data,
+                                     allow_redirects=False)
+        return response.status_code, \
+            int(response.headers.get('X-Query-Count', 0))
+
+
+def startServer(app):
+    """
+    This serves app from a threaded wsgiref server on a free local port and
+    returns its base URL.
+    """
+    from wsgiref.simple_server import make_server, WSGIServer
+    from wsgiref.simple_server import WSGIRequestHandler
+    try:
+        from SocketServer import ThreadingMixIn
+    except ImportError:
+        from socketserver import ThreadingMixIn
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = make_server('localhost', 0, app, ThreadingWSGIServer,
+                         QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://localhost:%d' % server.server_port
+
+
+class Catalog(object):
+    """
+    This samples existing categories and items to request and keeps track
+    of the items the write routes create, edit and delete.
+    """
+
+    def __init__(self, session, sample=500):
+        from database_setup import Category, Item, User
+        self.categories = [slug for slug, in session.query(Category.slug)]
+        self.items = session.query(Category.slug, Item.slug)\
+            .join(Item.category).limit(sample).all()
+        self.user_id = session.query(User.id).order_by(User.id).first()[0]
+        self.created = []
+        self.lock = threading.Lock()
+
+    def category(self, rng):
+        return rng.choice(self.categories)
+
+    def item(self, rng):
+        return tuple(rng.choice(self.items))
+
+    def addCreated(self, category, item):
+        with self.lock:
+            self.created.append((category, item))
+
+    def takeCreated(self):
+        with self.lock:
+            return self.created.pop() if self.created else None
+
+
+def buildRoutes(catalog, oauth):
+    """
+    This returns (name, login, request maker) for every route.  A request
+    maker takes a random generator and returns (method, url, form data), or
+    None when there is nothing left for it to do.
+    """
+    from benchmarks.dataset import WORDS
+    from slugs import slugify
+
+    def get(url):
+        return lambda rng: ('GET', url(rng), None)
+
+    def createItem(rng):
+        category = catalog.category(rng)
+        name = 'Bench %d %d' % (threading.current_thread().ident % 10000,
+                                rng.randint(0, 10 ** 9))
+        catalog.addCreated(category, slugify(name, 'item'))
+        return ('POST', '/catalog/%s/add/' % category,
+                {'name': name, 'description': 'Created by the benchmark.'})
+
+    def created(method, path, data=None):
+        def make(rng):
+            target = catalog.takeCreated()
+            if target is None:
+                return None
+            if method == 'GET' or path == 'edit':
+                # Put it back for the routes that run after this one.
+                catalog.addCreated(*target)
+            return (method, '/catalog/%s/%s/%s/' % (target + (path,)), data)
+        return make
+
+    user = {'user_id': catalog.user_id}
+    routes = [
+        ('home', {}, get(lambda rng: '/')),
+        ('category page', {},
+         get(lambda rng: '/catalog/%s/' % catalog.category(rng))),
+        ('category JSON', {},
+         get(lambda rng: '/catalog/%s/JSON' % catalog.category(rng))),
+        ('item page', {},
+         get(lambda rng: '/catalog/%s/%s/' % catalog.item(rng))),
+        ('item JSON', {},
+         get(lambda rng: '/catalog/%s/%s/JSON' % catalog.item(rng))),
+        ('search page', {},
+         get(lambda rng: '/search/?q=%s' % rng.choice(WORDS))),
+        ('search JSON', {},
+         get(lambda rng: '/search/JSON?q=%s' % rng.choice(WORDS))),
+        ('export NDJSON', {}, get(lambda rng: '/export/NDJSON')),
+        ('login page', {}, get(lambda rng: '/login/')),
+        ('add item form', user,
+         get(lambda rng: '/catalog/%s/add/' % catalog.category(rng))),
+        ('create item', user, createItem),
+        ('edit item form', user, created('GET', 'edit')),
+        ('edit item', user,
+         created('POST', 'edit', {'name': '',
+                                  'description': 'Edited by the benchmark.'})),
+        ('delete item form', user, created('GET', 'delete')),
+        ('delete item', user, created('POST', 'delete')),
+    ]
+    if oauth:
+        routes.append(('gconnect', {'state': 'bench'},
+                       lambda rng: ('POST', '/gconnect?state=bench',
+                                    'bench%d' % rng.randint(0, 100))))
+        routes.append(('gdisconnect', {'access_token': 'stub', 'gplus_id': '',
+                                       'username': '', 'email': '',
+                                       'picture': '', 'user_id': 0},
+                       get(lambda rng: '/gdisconnect')))
+    return routes
+
+
+def runRoute(makeClient, login, make, requests, concurrency, seed):
+    """
+    This sends requests made by make from concurrency threads and returns
+    the route's statistics.
+    """
+    latencies, queries, errors = [], [], [0]
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        client = makeClient()
+        for _ in range(per_thread):
+            client.login(login)
+            request = make(rng)
+            if request is None:
+                break
+            method, url, data = request
+            start = time.time()
+            status, count = client.request(method, url, data)
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+                queries.append(count)
+                if status >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - start
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput_rps': len(latencies) / wall if wall else 0.0,
+        'queries_per_request': (float(sum(queries)) / len(queries)
+                                if queries else 0.0),
+    }
+
+
+def printResults(results, baseline=None):
+    header = '%-18s %6s %5s %9s %9s %9s %9s %8s' % (
+        'route', 'reqs', 'errs', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s',
+        'queries')
+    if baseline:
+        header += ' %9s' % 'p95 diff'
+    print(header)
+    for name, stats in results.items():
+        line = '%-18s %6d %5d %9.2f %9.2f %9.2f %9.1f %8.1f' % (
+            name, stats['requests'], stats['errors'], stats['p50_ms'],
+            stats['p95_ms'], stats['p99_ms'], stats['throughput_rps'],
+            stats['queries_per_request'])
+        old = (baseline or {}).get(name)
+        if old and old['p95_ms']:
+            line += ' %+8.1f%%' % (
+                (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sqlite', metavar='PATH',
+                        help='benchmark against this SQLite file')
+    parser.add_argument('--generate', action='store_true',
+                        help='fill the database with a synthetic catalog')
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--skew', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route')
+    parser.add_argument('--routes', help='comma separated route names')
+    parser.add_argument('--server', action='store_true',
+                        help='go through a local WSGI server')
+    parser.add_argument('--oauth', action='store_true',
+                        help='include /gconnect against the stub OAuth '
+                             'server')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed p95 slowdown against --compare '
+                             '(fraction, default 0.2)')
+    args = parser.parse_args()
+
+    # The database and OAuth settings are read from the environment when
+    # their modules are imported, so it has to be in place first.
+    if args.sqlite:
+        os.environ['CATALOG_DATABASE_URL'] = 'sqlite:///' + \
+            os.path.abspath(args.sqlite)
+    os.environ.setdefault('CATALOG_CLIENT_SECRETS',
+                          os.path.join(REPO, 'client_secrets.json'))
+    if args.oauth:
+        from benchmarks import stub_oauth
+        stub = stub_oauth.serve(port=0)
+        base_url = 'http://localhost:%d' % stub.server_port
+        secrets = os.path.join(tempfile.mkdtemp(), 'client_secrets.json')
+        stub_oauth.writeSecrets(secrets, base_url)
+        os.environ['CATALOG_CLIENT_SECRETS'] = secrets
+        for name in ('certs', 'tokeninfo', 'userinfo', 'revoke'):
+            os.environ['CATALOG_GOOGLE_%s_URI' % name.upper()] = \
+                '%s/%s' % (base_url, name)
+
+    from flask import g
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from benchmarks.dataset import generate
+    from database import DBSession
+    from migrations import upgrade
+    from project import create_app
+
+    # A view over its query budget fails its request, so N+1 regressions
+    # show up as errors.
+    app = create_app({'ENFORCE_QUERY_BUDGETS': True})
+
+    if args.generate:
+        generate(categories=args.categories, items=args.items,
+                 users=args.users, seed=args.seed, skew=args.skew)
+    else:
+        upgrade()
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def countStatement(*arguments):
+        try:
+            g.bench_queries = getattr(g, 'bench_queries', 0) + 1
+        except RuntimeError:
+            pass
+
+    @app.after_request
+    def reportQueries(response):
+        response.headers['X-Query-Count'] = str(getattr(g, 'bench_queries', 0))
+        return response
+
+    catalog = Catalog(DBSession())
+    DBSession.remove()
+    if args.server:
+        base_url = startServer(app)
+
+        def makeClient():
+            return ServerClient(app, base_url)
+    else:
+        def makeClient():
+            return TestClient(app)
+
+    wanted = args.routes.split(',') if args.routes else None
+    results = OrderedDict()
+    for name, login, make in buildRoutes(catalog, args.oauth):
+        if wanted and name not in wanted:
+            continue
+        results[name] = runRoute(makeClient, login, make, args.requests,
+                                 args.concurrency, args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['routes']
+    printResults(results, baseline)
+    failed = [name for name, stats in results.items() if stats['errors']]
+    if failed:
+        # Timings of failed requests are not a baseline to compare with.
+        print('errors for: %s' % ', '.join(failed))
+        if args.save:
+            print('not saving %s' % args.save)
+        return 1
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'settings': vars(args), 'time': time.time(),
+                       'routes': results}, f, indent=2, sort_keys=True)
+    if baseline:
+        regressed = [name for name, stats in results.items()
+                     if name in baseline and baseline[name]['p95_ms'] and
+                     stats['p95_ms'] > baseline[name]['p95_ms'] *
+                     (1 + args.max_regression)]
+        if regressed:
+            print('p95 regressed for: %s' % ', '.join(regressed))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
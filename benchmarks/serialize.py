@@ -0,0 +1,111 @@
+"""
+Compares the two ways a category's items can be turned into the JSON that
+/catalog/<category>/JSON returns.
+
+    python -m benchmarks.serialize --sizes 10000,100000 --repeat 5
+
+The ORM path loads Item objects, calls serialize on each and hands the list
+to jsonify, as the view used to.  The row path queries only the serialized
+columns and encodes the rows with fastjson (orjson, or simplejson on
+Python 2, when installed).  Each size gets its own SQLite file with all
+items in one category, kept in a new temporary directory unless --dir is
+given.  The whole category is serialized as one document, and the script
+fails if the two paths produce different documents.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def ormPath(session):
+    from flask import jsonify
+    from database_setup import Item
+    items = session.query(Item).filter(Item.category_id == 1)\
+        .order_by(Item.name, Item.id).all()
+    return jsonify(Item=[item.serialize for item in items],
+                   next=None).get_data()
+
+
+def rowPath(session):
+    from database_setup import Item
+    from fastjson import ITEM_COLUMNS, itemDict, jsonResponse
+    rows = session.query(*ITEM_COLUMNS).filter(Item.category_id == 1)\
+        .order_by(Item.name, Item.id).all()
+    return jsonResponse(Item=[itemDict(row) for row in rows],
+                        next=None).get_data()
+
+
+def timePath(path, engine, repeat):
+    """
+    This runs path repeat times, each with a fresh session as a request
+    would have, and returns the timings in ms and the last body.
+    """
+    Session = sessionmaker(bind=engine)
+    timings = []
+    for _ in range(repeat):
+        session = Session()
+        start = time.time()
+        body = path(session)
+        timings.append((time.time() - start) * 1000)
+        session.close()
+    return timings, body
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='comma separated item counts to try')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--dir', help='where to keep the SQLite files '
+                                      '(default: a new temporary directory)')
+    args = parser.parse_args()
+
+    from benchmarks.dataset import generate
+    from database import make_engine
+    from fastjson import ENCODER
+    from project import create_app
+
+    if args.dir is None:
+        args.dir = tempfile.mkdtemp(prefix='serialize_bench')
+    elif not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+    print('encoder: %s' % ENCODER)
+    print('%8s %12s %12s %8s' % ('items', 'orm ms', 'rows ms', 'speedup'))
+    failures = 0
+    for size in [int(n) for n in args.sizes.split(',')]:
+        path = os.path.abspath(os.path.join(args.dir, 'items%d.db' % size))
+        url = 'sqlite:///' + path
+        engine = make_engine(url)
+        if not os.path.exists(path):
+            generate(engine, categories=1, items=size, users=100)
+        app = create_app({'DATABASE_URL': url})
+        with app.test_request_context():
+            orm, orm_body = timePath(ormPath, engine, args.repeat)
+            rows, row_body = timePath(rowPath, engine, args.repeat)
+        print('%8d %12.1f %12.1f %7.2fx' % (
+            size, median(orm), median(rows), median(orm) / median(rows)))
+        if json.loads(orm_body.decode('utf-8')) != \
+                json.loads(row_body.decode('utf-8')):
+            print('FAIL: the two paths produced different documents')
+            failures += 1
+        engine.dispose()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
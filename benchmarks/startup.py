@@ -0,0 +1,84 @@
+"""
+Measures how long a fresh worker process takes to import the app, create it
+and answer its first request, the way a mod_wsgi worker does after a fork.
+
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.startup --sqlite /tmp/bench.db
+
+Each run starts a new interpreter, so nothing is shared between runs.
+Without --sqlite the database named by CATALOG_DATABASE_URL is used.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process and prints its timings as JSON.
+CHILD = """
+import json, sys, time
+start = time.time()
+import project
+imported = time.time()
+app = project.create_app()
+created = time.time()
+response = app.test_client().get('/')
+answered = time.time()
+json.dump({'import_ms': (imported - start) * 1000,
+           'create_ms': (created - imported) * 1000,
+           'first_request_ms': (answered - created) * 1000,
+           'status': response.status_code}, sys.stdout)
+"""
+
+
+def measure(env):
+    output = subprocess.check_output([sys.executable, '-c', CHILD],
+                                     cwd=REPO, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--sqlite', metavar='PATH',
+                        help='start against this SQLite file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.sqlite:
+        env['CATALOG_DATABASE_URL'] = 'sqlite:///' + \
+            os.path.abspath(args.sqlite)
+    env.setdefault('CATALOG_CLIENT_SECRETS',
+                   os.path.join(REPO, 'client_secrets.json'))
+    if args.sqlite:
+        subprocess.check_call([sys.executable, 'migrations.py', 'upgrade'],
+                              cwd=REPO, env=env, stdout=subprocess.PIPE)
+
+    runs = [measure(env) for _ in range(args.runs)]
+    print('%-18s %10s %10s %10s' % ('phase', 'median ms', 'min ms',
+                                    'max ms'))
+    for phase in ('import_ms', 'create_ms', 'first_request_ms'):
+        values = [run[phase] for run in runs]
+        print('%-18s %10.1f %10.1f %10.1f' % (
+            phase[:-3], median(values), min(values), max(values)))
+    statuses = set(run['status'] for run in runs)
+    if statuses != set([200]):
+        print('first request returned %s' % ', '.join(map(str, statuses)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
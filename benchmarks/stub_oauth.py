@@ -0,0 +1,209 @@
+"""
+A local stand-in for Google's OAuth endpoints, for exercising /gconnect and
+/gdisconnect end to end without network access.
+
+    python -m benchmarks.stub_oauth --port 8765 --write-secrets /tmp/stub.json
+
+Then start the app with
+    CATALOG_CLIENT_SECRETS=/tmp/stub.json
+    CATALOG_GOOGLE_CERTS_URI=http://localhost:8765/certs
+    CATALOG_GOOGLE_TOKENINFO_URI=http://localhost:8765/tokeninfo
+    CATALOG_GOOGLE_USERINFO_URI=http://localhost:8765/userinfo
+    CATALOG_GOOGLE_REVOKE_URI=http://localhost:8765/revoke
+and POST any authorization code, e.g. "alice", to /gconnect.  The code names
+the user that signs in (alice@example.com).
+
+ID tokens are signed with a throwaway RSA key when the cryptography package
+is installed, so they verify locally against /certs.  Otherwise /certs is
+empty and the app falls back to /tokeninfo, which the stub also answers.
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+CLIENT_ID = 'stub-client-id.apps.googleusercontent.com'
+KEY_ID = 'stub-key'
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class Signer(object):
+    """
+    This signs JWTs with RS256 and publishes the matching certificate, or
+    produces unsigned tokens when cryptography is not installed.
+    """
+
+    def __init__(self):
+        self.certs = {}
+        self.key = None
+        try:
+            from cryptography import x509
+            from cryptography.hazmat.backends import default_backend
+            from cryptography.hazmat.primitives import hashes, serialization
+            from cryptography.hazmat.primitives.asymmetric import rsa
+            from cryptography.x509.oid import NameOID
+        except ImportError:
+            return
+        import datetime
+        backend = default_backend()
+        self.key = rsa.generate_private_key(65537, 2048, backend)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'stub')])
+        now = datetime.datetime.utcnow()
+        cert = x509.CertificateBuilder().subject_name(name)\
+            .issuer_name(name).public_key(self.key.public_key())\
+            .serial_number(1).not_valid_before(now)\
+            .not_valid_after(now + datetime.timedelta(days=1))\
+            .sign(self.key, hashes.SHA256(), backend)
+        self.certs[KEY_ID] = cert.public_bytes(
+            serialization.Encoding.PEM).decode('ascii')
+        self.hashes = hashes
+
+    def token(self, claims):
+        header = {'alg': 'RS256' if self.key else 'none', 'kid': KEY_ID,
+                  'typ': 'JWT'}
+        signing_input = '%s.%s' % (b64(json.dumps(header).encode('utf-8')),
+                                   b64(json.dumps(claims).encode('utf-8')))
+        signature = b''
+        if self.key:
+            from cryptography.hazmat.primitives.asymmetric import padding
+            signature = self.key.sign(signing_input.encode('ascii'),
+                                      padding.PKCS1v15(),
+                                      self.hashes.SHA256())
+        return '%s.%s' % (signing_input, b64(signature) or 'unsigned')
+
+
+class StubState(object):
+    def __init__(self):
+        self.signer = Signer()
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def claimsFor(self, code):
+        now = int(time.time())
+        return {'iss': 'accounts.google.com', 'aud': CLIENT_ID,
+                'azp': CLIENT_ID, 'sub': 'stub-%s' % code,
+                'email': '%s@example.com' % code, 'email_verified': True,
+                'name': code.title(),
+                'picture': 'https://example.com/%s.png' % code,
+                'iat': now, 'exp': now + 3600}
+
+
+def makeHandler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, status, data, headers=None):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            form = parse_qs(self.rfile.read(length).decode('utf-8'))
+            if urlparse(self.path).path != '/token':
+                return self.reply(404, {'error': 'not_found'})
+            code = form.get('code', ['user'])[0]
+            claims = state.claimsFor(code)
+            access_token = 'stub-access-%s-%d' % (code, time.time() * 1000)
+            with state.lock:
+                state.tokens[access_token] = claims
+            self.reply(200, {'access_token': access_token,
+                             'token_type': 'Bearer', 'expires_in': 3600,
+                             'id_token': state.signer.token(claims)})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            args = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+            if url.path == '/certs':
+                self.reply(200, state.signer.certs,
+                           {'Cache-Control': 'public, max-age=3600'})
+            elif url.path == '/tokeninfo':
+                try:
+                    payload = args['id_token'].split('.')[1]
+                    payload += '=' * (-len(payload) % 4)
+                    self.reply(200, json.loads(
+                        base64.urlsafe_b64decode(payload.encode('ascii'))
+                        .decode('utf-8')))
+                except (KeyError, IndexError, ValueError):
+                    self.reply(400, {'error_description': 'Invalid Value'})
+            elif url.path == '/userinfo':
+                with state.lock:
+                    claims = state.tokens.get(args.get('access_token'))
+                if claims is None:
+                    return self.reply(401, {'error': 'invalid_token'})
+                self.reply(200, {'id': claims['sub'], 'name': claims['name'],
+                                 'email': claims['email'],
+                                 'picture': claims['picture']})
+            elif url.path == '/revoke':
+                with state.lock:
+                    state.tokens.pop(args.get('token'), None)
+                self.reply(200, {})
+            else:
+                self.reply(404, {'error': 'not_found'})
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(host='localhost', port=8765):
+    """
+    This starts the stub in a background thread and returns the server.
+    """
+    server = ThreadingHTTPServer((host, port), makeHandler(StubState()))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def writeSecrets(path, base_url):
+    with open(path, 'w') as f:
+        json.dump({'web': {
+            'client_id': CLIENT_ID,
+            'client_secret': 'stub-secret',
+            'auth_uri': base_url + '/auth',
+            'token_uri': base_url + '/token',
+            'redirect_uris': ['postmessage'],
+        }}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--write-secrets', metavar='PATH',
+                        help='write a client_secrets.json for the stub')
+    args = parser.parse_args()
+    base_url = 'http://%s:%d' % (args.host, args.port)
+    if args.write_secrets:
+        writeSecrets(args.write_secrets, base_url)
+    server = ThreadingHTTPServer((args.host, args.port),
+                                 makeHandler(StubState()))
+    print('Stub OAuth server listening on %s' % base_url)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+"""
+Bulk loads catalog items from CSV or JSON lines files.
+
+    python bulkload.py items.csv more_items.jsonl --batch-size 5000
+
+Each row needs a category and a name and may also have a description,
+user_email, user_name and user_picture.  Categories and users that do not
+exist yet are created.  Items are matched on (category, name): existing
+items are updated and new ones inserted, so loading the same file twice
+leaves the database unchanged.  An update from a row without a user_email
+keeps the item's owner.  Every item the load creates or changes is written
+to the change log that the /changes feed serves; rows that match what is
+stored already are skipped.
+
+On Postgres each batch is sent with COPY into a temporary table and merged
+with INSERT ... ON CONFLICT.  Other databases fall back to executemany
+inserts and updates.
+"""
+import argparse
+import csv
+import io
+import json
+import string
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sqlalchemy import and_, bindparam, select
+
+from changes import recordChanges
+from database import get_engine, make_engine
+from database_setup import User, Category, Item, CatalogState
+from migrations import upgrade
+from search import reindexItems
+from slugs import slugify, takenSlugs, uniqueSlug
+
+BATCH_SIZE = 5000
+# SQLite limits the number of parameters in one statement, so IN lists are
+# sent in slices of this size.
+LOOKUP_SIZE = 500
+
+
+def slices(values, size=LOOKUP_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def textField(value):
+    # Python 2's csv module reads byte strings.
+    if bytes is str and isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def readRows(path):
+    """
+    This yields the rows of a UTF-8 .csv file (with a header line) or of a
+    JSON lines file as dictionaries of text.
+    """
+    if path.endswith('.csv'):
+        if bytes is str:
+            f = open(path, 'rb')
+        else:
+            f = io.open(path, encoding='utf-8', newline='')
+        with f:
+            for row in csv.DictReader(f):
+                yield dict((textField(key), textField(value))
+                           for key, value in row.items())
+    else:
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def csvField(value):
+    # Python 2's csv module only writes byte strings.
+    if bytes is str and isinstance(value, type(u'')):
+        return value.encode('utf-8')
+    return value
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkLoader(object):
+    """
+    This loads rows in batches, one transaction per batch, and remembers the
+    ids of the categories and users it has already resolved.
+    """
+
+    def __init__(self, bind, batch_size=BATCH_SIZE, progress=sys.stderr):
+        self.bind = bind
+        self.batch_size = batch_size
+        self.progress = progress
+        self.categories = {}
+        self.users = {}
+        self.loaded = 0
+
+    def load(self, rows):
+        start = time.time()
+        for batch in batches(rows, self.batch_size):
+            with self.bind.begin() as conn:
+                self.loadBatch(conn, batch)
+            self.loaded += len(batch)
+            if self.progress:
+                self.progress.write('\r%d rows loaded (%.0f rows/s)' % (
+                    self.loaded, self.loaded / max(time.time() - start, 1e-6)))
+                self.progress.flush()
+        if self.progress:
+            self.progress.write('\n')
+        return self.loaded
+
+    def loadBatch(self, conn, batch):
+        # Locking the catalog_state row first serializes this batch with the
+        # app's writes, which update it, so change log rows become visible
+        # in seq order.
+        self.lockCatalogState(conn)
+        self.resolveCategories(conn, [string.capwords(row['category'])
+                                      for row in batch])
+        self.resolveUsers(conn, batch)
+        # Later rows for the same item win, as they would if the rows were
+        # loaded one at a time.
+        items = OrderedDict()
+        for row in batch:
+            category_id = self.categories[string.capwords(row['category'])]
+            name = string.capwords(row['name'])
+            items[(category_id, name)] = {
+                'category_id': category_id,
+                'name': name,
+                'description': row.get('description') or None,
+                'user_id': self.users.get(row.get('user_email')),
+            }
+        self.assignItemSlugs(conn, items)
+        if conn.dialect.name == 'postgresql':
+            changes = self.upsertItemsWithCopy(conn, list(items.values()))
+        else:
+            changes = self.upsertItems(conn, items)
+        recordChanges(conn, changes)
+        if changes:
+            self.bumpCatalogVersion(conn)
+
+    def lockCatalogState(self, conn):
+        table = CatalogState.__table__
+        conn.execute(select([table.c.version]).where(table.c.id == 1)
+                     .with_for_update())
+
+    def bumpCatalogVersion(self, conn):
+        # Invalidate the validators the web app hands out, as its own write
+        # paths do.
+        table = CatalogState.__table__
+        conn.execute(table.update().where(table.c.id == 1).values(
+            version=table.c.version + 1, modified=datetime.utcnow()))
+
+    def resolveCategories(self, conn, names):
+        table = Category.__table__
+        missing = set(names) - set(self.categories)
+        self.fetchIds(conn, table.c.name, missing, self.categories)
+        new = [name for name in missing if name not in self.categories]
+        if new:
+            rows, assigned = [], set()
+            for name in new:
+                base = slugify(name, 'category')
+                slug = uniqueSlug(base, assigned |
+                                  takenSlugs(conn, table.c.slug, base))
+                assigned.add(slug)
+                rows.append({'name': name, 'slug': slug})
+            conn.execute(table.insert(), rows)
+            self.fetchIds(conn, table.c.name, new, self.categories)
+
+    def resolveUsers(self, conn, batch):
+        table = User.__table__
+        users = dict((row['user_email'], row) for row in batch
+                     if row.get('user_email'))
+        missing = set(users) - set(self.users)
+        self.fetchIds(conn, table.c.email, missing, self.users)
+        new = [email for email in missing if email not in self.users]
+        if new:
+            conn.execute(table.insert(), [
+                {'email': email, 'name': users[email].get('user_name'),
+                 'picture': users[email].get('user_picture')}
+                for email in new])
+            self.fetchIds(conn, table.c.email, new, self.users)
+
+    def fetchIds(self, conn, column, values, ids):
+        table = column.table
+        for chunk in slices(values):
+            query = select([table.c.id, column]).where(column.in_(chunk))
+            for row_id, value in conn.execute(query):
+                ids[value] = row_id
+
+    def assignItemSlugs(self, conn, items):
+        """
+        This gives every item in the batch the slug it is inserted with.
+        Existing items keep their slug, since neither upsert path updates
+        it, so only a slug already taken by a differently named item in the
+        category costs an extra query.
+        """
+        table = Item.__table__
+        owners = {}
+        category_ids = set(key[0] for key in items)
+        bases = dict((key, slugify(key[1], 'item')) for key in items)
+        for chunk in slices(set(bases.values())):
+            query = select([table.c.category_id, table.c.slug, table.c.name])\
+                .where(and_(table.c.category_id.in_(category_ids),
+                            table.c.slug.in_(chunk)))
+            for category_id, slug, name in conn.execute(query):
+                owners[(category_id, slug)] = name
+        assigned = set()
+        for key, item in items.items():
+            category_id, base = key[0], bases[key]
+            slug = base
+            if owners.get((category_id, base), key[1]) != key[1] or \
+                    (category_id, base) in assigned:
+                taken = takenSlugs(conn, table.c.slug, base,
+                                   table.c.category_id == category_id)
+                taken.update(s for c, s in assigned if c == category_id)
+                slug = uniqueSlug(base, taken)
+            assigned.add((category_id, slug))
+            item['slug'] = slug
+
+    def lookupItems(self, conn, keys):
+        """
+        This returns the (id, slug, description, user_id) of each of the
+        (category_id, name) keys that exists.
+        """
+        table = Item.__table__
+        found = {}
+        category_ids = set(key[0] for key in keys)
+        for chunk in slices(set(key[1] for key in keys)):
+            query = select([table.c.id, table.c.slug, table.c.description,
+                            table.c.user_id, table.c.category_id,
+                            table.c.name])\
+                .where(and_(table.c.category_id.in_(category_ids),
+                            table.c.name.in_(chunk)))
+            for row in conn.execute(query):
+                if (row.category_id, row.name) in keys:
+                    found[(row.category_id, row.name)] = tuple(row[:4])
+        return found
+
+    def upsertItems(self, conn, items):
+        """
+        This is the portable path: look up which items already exist, then
+        insert the new ones and update the changed ones with one executemany
+        each.  It returns the change log entries for the batch.
+        """
+        table = Item.__table__
+        existing = self.lookupItems(conn, items)
+        now = datetime.now()
+        for key, item in items.items():
+            # A row without a user keeps the item's current owner.
+            if key in existing and item['user_id'] is None:
+                item['user_id'] = existing[key][3]
+        inserts = [dict(item, time=now) for key, item in items.items()
+                   if key not in existing]
+        changed = [key for key, item in items.items() if key in existing and
+                   existing[key][2:] != (item['description'],
+                                         item['user_id'])]
+        if inserts:
+            conn.execute(table.insert(), inserts)
+        if changed:
+            conn.execute(table.update()
+                         .where(table.c.id == bindparam('item_id'))
+                         .values(description=bindparam('new_description'),
+                                 user_id=bindparam('new_user_id')),
+                         [{'item_id': existing[key][0],
+                           'new_description': items[key]['description'],
+                           'new_user_id': items[key]['user_id']}
+                          for key in changed])
+        created = self.lookupItems(conn, set(key for key in items
+                                             if key not in existing))
+        reindexItems(conn, list(created) + changed)
+        return [(created[key][0], key[0], created[key][1], 'create')
+                for key in items if key in created] + \
+            [(existing[key][0], key[0], existing[key][1], 'update')
+             for key in changed]
+
+    def upsertItemsWithCopy(self, conn, items):
+        """
+        This is the Postgres path: COPY the batch into a temporary table and
+        merge it into item with a single INSERT ... ON CONFLICT.  It returns
+        the change log entries for the batch; xmax is 0 only in rows the
+        statement inserted rather than updated, and rows that already held
+        the loaded values are neither updated nor returned.
+        """
+        cursor = conn.connection.cursor()
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS item_load '
+                       '(category_id integer, name varchar(250), '
+                       'slug varchar(250), description varchar(2000), '
+                       'user_id integer) ON COMMIT DELETE ROWS')
+        buf = StringIO()
+        writer = csv.writer(buf)
+        for item in items:
+            writer.writerow([csvField(item[column]) for column in (
+                'category_id', 'name', 'slug', 'description', 'user_id')])
+        buf.seek(0)
+        cursor.copy_expert("COPY item_load FROM STDIN WITH "
+                           "(FORMAT csv, ENCODING 'UTF8')", buf)
+        cursor.execute('INSERT INTO item (category_id, name, slug, '
+                       'description, user_id, time) '
+                       'SELECT category_id, name, slug, description, '
+                       'user_id, %s '
+                       'FROM item_load '
+                       'ON CONFLICT (category_id, name) DO UPDATE '
+                       'SET description = EXCLUDED.description, '
+                       'user_id = COALESCE(EXCLUDED.user_id, item.user_id) '
+                       'WHERE (item.description, item.user_id) IS DISTINCT '
+                       'FROM (EXCLUDED.description, '
+                       'COALESCE(EXCLUDED.user_id, item.user_id)) '
+                       'RETURNING id, category_id, slug, xmax = 0',
+                       (datetime.now(),))
+        return [(row_id, category_id, slug,
+                 'create' if inserted else 'update')
+                for row_id, category_id, slug, inserted in cursor.fetchall()]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help='.csv or .jsonl files')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--database-url',
+                        help='load into this database instead of the '
+                             'configured one')
+    args = parser.parse_args(argv)
+    if args.database_url:
+        bind = make_engine(args.database_url)
+    else:
+        bind = get_engine()
+    upgrade(bind)
+    loader = BulkLoader(bind, batch_size=args.batch_size)
+    start = time.time()
+    for path in args.files:
+        loader.load(readRows(path))
+    elapsed = time.time() - start
+    print('Loaded %d rows in %.1fs (%.0f rows/s)'
+          % (loader.loaded, elapsed, loader.loaded / max(elapsed, 1e-6)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
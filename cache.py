@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from sqlalchemy import desc
+from database import DBSession
+from database_setup import Category, Item
+
+CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 300))
+CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', 256))
+
+# Cached rows are plain tuples rather than ORM objects, so they can be shared
+# between threads and outlive the session that loaded them.
+CategoryRow = namedtuple('CategoryRow', ['id', 'name', 'slug'])
+NewestItem = namedtuple('NewestItem', ['id', 'name', 'slug', 'category'])
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """
+    A thread safe in-process cache.  Entries expire ttl seconds after they
+    were stored and the least recently used entry is evicted once more than
+    maxsize entries are held.  Entries can be stored with tags so that every
+    entry derived from some piece of data can be dropped together.
+
+    Invalidation only reaches this process's copy.  Other processes keep
+    serving what they hold until it expires, so data that must never be
+    served stale after a write in another process has to be keyed by
+    something that changes with it, such as the catalog version.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped by every invalidation, so a load that started before one
+        # is not stored after it.
+        self._generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+            if entry is _MISSING or entry[0] < time.time():
+                self.misses += 1
+                return default
+            # Re-inserting moves the key to the most recently used end.
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            self._store(key, value, tags)
+
+    def _store(self, key, value, tags):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + self.ttl, value, frozenset(tags))
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        This returns the cached value for key, calling loader() to fill the
+        cache on a miss.  If the cache is invalidated while loader() runs,
+        what it loaded may predate the write behind the invalidation, so it
+        is returned but not stored.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            with self._lock:
+                generation = self._generation
+            value = loader()
+            with self._lock:
+                if generation == self._generation:
+                    self._store(key, value, ())
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def invalidate_tags(self, *tags):
+        """
+        This drops every entry stored with any of the given tags.
+        """
+        tags = frozenset(tags)
+        with self._lock:
+            self._generation += 1
+            for key in [key for key, entry in self._entries.items()
+                        if entry[2] & tags]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._entries)}
+
+
+# Keyed by catalog version as well, for the same reason as the page cache:
+# clearing it only reaches the process that made the write, and pages
+# rendered for a new version must not be built from another process's
+# stale lists.
+catalog_cache = TTLCache()
+
+
+def catalogVersion():
+    # conditional imports this module (through compress), so it is imported
+    # here rather than at the top.
+    from conditional import getCatalogState
+    return getCatalogState()[0]
+
+
+def getCategories():
+    """
+    This returns every category for the navigation sidebar.
+    """
+    def load():
+        rows = DBSession.query(Category.id, Category.name, Category.slug)\
+            .order_by(Category.id).all()
+        return [CategoryRow(*row) for row in rows]
+    return catalog_cache.get_or_load(('categories', catalogVersion()), load)
+
+
+def getCategoryMap():
+    """
+    This returns a dictionary mapping both the slug and the id (as a string)
+    of every category to its row, i.e. every way a URL can name it.
+    """
+    def load():
+        categories = dict((c.slug, c) for c in getCategories())
+        categories.update((str(c.id), c) for c in getCategories())
+        return categories
+    return catalog_cache.get_or_load(('category_map', catalogVersion()),
+                                     load)
+
+
+def getNewestItems(limit=5):
+    """
+    This returns the newest items along with the category each belongs to.
+    """
+    def load():
+        rows = DBSession.query(Item.id, Item.name, Item.slug, Category.id,
+                               Category.name, Category.slug)\
+            .join(Item.category).order_by(desc(Item.time)).limit(limit).all()
+        return [NewestItem(row[0], row[1], row[2], CategoryRow(*row[3:]))
+                for row in rows]
+    return catalog_cache.get_or_load(
+        ('newest_items', limit, catalogVersion()), load)
+
+
+def invalidateCatalogCache():
+    """
+    This drops every cached navigation entry.  The item write paths call it
+    after they commit so the next request sees the change.
+    """
+    catalog_cache.clear()
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from sqlalchemy import func
+from database_setup import Item, ItemChange
+
+# The longest a /changes request may wait for a change to arrive, and how
+# often a waiting request looks for changes written by other processes.
+MAX_WAIT = int(os.environ.get('CATALOG_CHANGES_MAX_WAIT', 30))
+POLL_INTERVAL = float(os.environ.get('CATALOG_CHANGES_POLL_INTERVAL', 1))
+
+# Woken after every change this process commits, so waiting requests in the
+# same process answer straight away instead of at their next poll.
+_changed = threading.Condition()
+
+
+def recordChange(session, item, action):
+    """
+    This adds the change log row for a write of item ('create', 'update' or
+    'delete').  It must be called after the write has been flushed, so the
+    item has its id, and before it is committed.
+    """
+    session.add(ItemChange(item_id=item.id, category_id=item.category_id,
+                           slug=item.slug, action=action))
+
+
+def recordChanges(conn, changes):
+    """
+    This adds change log rows for writers that bypass the ORM, such as the
+    bulk loader.  changes holds (item_id, category_id, slug, action) tuples.
+    """
+    if changes:
+        conn.execute(ItemChange.__table__.insert(), [
+            {'item_id': item_id, 'category_id': category_id, 'slug': slug,
+             'action': action}
+            for item_id, category_id, slug, action in changes])
+
+
+def notifyChanges():
+    """
+    This wakes the requests waiting for changes.  Call it after commit.
+    """
+    with _changed:
+        _changed.notify_all()
+
+
+def latestSeq(session):
+    return session.query(func.max(ItemChange.seq)).scalar() or 0
+
+
+def getChanges(session, since, limit, category_id=None):
+    """
+    This returns up to limit changes after since, oldest first, each paired
+    with the item's current state (None once it has been deleted).
+    """
+    query = session.query(ItemChange, Item)\
+        .outerjoin(Item, Item.id == ItemChange.item_id)\
+        .filter(ItemChange.seq > since)
+    if category_id is not None:
+        query = query.filter(ItemChange.category_id == category_id)
+    return query.order_by(ItemChange.seq).limit(limit).all()
+
+
+def waitForChanges(session, since, limit, category_id=None, wait=0):
+    """
+    This returns what getChanges would, but when there are no changes yet it
+    waits up to wait seconds for one to be written.  The session's
+    connection goes back to the pool between polls, so waiting requests do
+    not hold database connections.
+    """
+    deadline = time.time() + min(max(wait, 0), MAX_WAIT)
+    while True:
+        changes = getChanges(session, since, limit, category_id)
+        session.close()
+        remaining = deadline - time.time()
+        if changes or remaining <= 0:
+            return changes
+        with _changed:
+            _changed.wait(min(remaining, POLL_INTERVAL))
@@ -0,0 +1,125 @@
+import os
+import zlib
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from flask import request
+from cache import TTLCache, CACHE_TTL
+
+# Bodies smaller than this are sent as they are; compressing them saves
+# less than the time it takes.
+COMPRESS_MIN_SIZE = int(os.environ.get('CATALOG_COMPRESS_MIN_SIZE', 500))
+COMPRESS_CACHE_SIZE = int(os.environ.get('CATALOG_COMPRESS_CACHE_SIZE', 256))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = frozenset([
+    'text/html', 'text/css', 'text/plain', 'application/json',
+    'application/x-ndjson', 'application/javascript'])
+
+# Compressed bodies keyed by ETag and encoding.  The ETag changes whenever
+# the body does, so entries never go stale; they only age out.
+compressed_cache = TTLCache(maxsize=COMPRESS_CACHE_SIZE, ttl=CACHE_TTL)
+
+
+def etagVariants(etag):
+    """
+    This returns the ETags a client may hold for a response whose ETag is
+    etag: the plain one and the one of each compressed version.
+    """
+    return [etag, etag + '-gzip', etag + '-br']
+
+
+def chooseEncoding():
+    """
+    This returns the best encoding the client accepts, or None.
+    """
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compressBody(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzipStream(chunks):
+    """
+    This gzips a streamed body as it is generated.  Each chunk is flushed,
+    so the client receives data as soon as the app has produced it.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + \
+            compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compressResponse(response):
+    """
+    This compresses a response's body with the best encoding the client
+    accepts.  Streamed responses are gzipped on the fly when the client
+    accepts gzip; other bodies are compressed whole once they reach
+    COMPRESS_MIN_SIZE, and responses with an ETag reuse the compressed body
+    cached under it.
+    """
+    if response.mimetype not in COMPRESSIBLE_TYPES or \
+            'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = chooseEncoding()
+    etag, weak = response.get_etag()
+    if encoding is None:
+        return response
+    if response.status_code == 304:
+        # Tell the client which of the variants it holds is still fresh.
+        if etag:
+            response.set_etag('%s-%s' % (etag, encoding), weak)
+        return response
+    if response.status_code != 200:
+        return response
+    if response.is_streamed:
+        # Streamed bodies are only ever gzipped, so a client that offered
+        # brotli alone gets them uncompressed.
+        if not request.accept_encodings['gzip']:
+            return response
+        response.response = gzipStream(response.response)
+        response.headers.pop('Content-Length', None)
+        encoding = 'gzip'
+    else:
+        # send_file responses hand the file straight to the server unless
+        # told otherwise.
+        response.direct_passthrough = False
+        length = response.calculate_content_length()
+        if length is None or length < COMPRESS_MIN_SIZE:
+            return response
+        key = (etag, encoding)
+        body = compressed_cache.get(key) if etag else None
+        if body is None:
+            body = compressBody(response.get_data(), encoding)
+            if etag:
+                compressed_cache.set(key, body)
+        response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag('%s-%s' % (etag, encoding), weak)
+    return response
+
+
+def init_app(app):
+    """
+    This compresses the app's text responses for clients that accept it.
+    """
+    app.after_request(compressResponse)
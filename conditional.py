@@ -0,0 +1,75 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+from flask import g, has_request_context, request, make_response, Response
+from flask import session as login_session
+from database import DBSession
+from database_setup import CatalogState
+from compress import etagVariants
+
+
+def bumpCatalogVersion(session):
+    """
+    This increments the catalog version and modification time.  It must be
+    called before the write it belongs to is committed, so the new version
+    becomes visible in the same transaction as the change.
+    """
+    session.query(CatalogState).filter_by(id=1).update(
+        {CatalogState.version: CatalogState.version + 1,
+         CatalogState.modified: datetime.utcnow()},
+        synchronize_session=False)
+
+
+def getCatalogState():
+    """
+    This returns the current catalog version and modification time, read
+    once per request so the validators and the cache keys agree.
+    """
+    if has_request_context() and hasattr(g, 'catalog_state'):
+        return g.catalog_state
+    state = DBSession.query(CatalogState.version, CatalogState.modified)\
+        .filter_by(id=1).one()
+    if has_request_context():
+        g.catalog_state = state
+    return state
+
+
+def conditional(f):
+    """
+    This decorator adds a strong ETag and a Last-Modified header to a view's
+    response.  Both come from the catalog version, so a request carrying a
+    matching If-None-Match or If-Modified-Since gets a 304 before the view
+    runs any item queries or renders its template.
+
+    The ETag also covers the URL and the logged in user, because the HTML
+    pages show different controls to different users.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        version, modified = getCatalogState()
+        key = '%s|%s|%s' % (request.full_path, version,
+                            login_session.get('user_id'))
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        last_modified = modified.replace(microsecond=0)
+
+        not_modified = False
+        if request.if_none_match:
+            # The client may hold a compressed copy, whose ETag has the
+            # encoding appended.
+            not_modified = any(request.if_none_match.contains(variant)
+                               for variant in etagVariants(etag))
+        elif request.if_modified_since:
+            since = request.if_modified_since.replace(tzinfo=None)
+            not_modified = since >= last_modified
+
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Clients may keep the body but must revalidate before reusing it.
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Cookie')
+        return response
+    return decorated_function
@@ -0,0 +1,67 @@
+import os
+from database_setup import Category
+from fastjson import ITEM_COLUMNS, dumps, itemDict
+
+# Rows fetched per round trip while streaming the catalog.
+EXPORT_BATCH_SIZE = int(os.environ.get('CATALOG_EXPORT_BATCH_SIZE', 1000))
+# Bytes of output gathered before a chunk is handed to the server.
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def iterCatalog(session, batch_size=EXPORT_BATCH_SIZE):
+    """
+    This yields ('Category', dict) for every category and then ('Item', dict)
+    for every item.  Items are read through a server-side cursor in batches
+    of batch_size, so only one batch is held in memory at a time however
+    large the catalog is.  They are read as plain rows rather than Item
+    objects, so nothing accumulates in the session's identity map.
+    """
+    for category in session.query(Category).order_by(Category.id):
+        yield 'Category', category.serialize
+    rows = session.query(*ITEM_COLUMNS).order_by(ITEM_COLUMNS[0])\
+        .execution_options(stream_results=True).yield_per(batch_size)
+    for row in rows:
+        yield 'Item', itemDict(row)
+
+
+def chunked(pieces, size=EXPORT_CHUNK_SIZE):
+    """
+    This joins many small strings into chunks of about size characters so
+    the server is not asked to write (and flush) every row separately.
+    """
+    buffered, length = [], 0
+    for piece in pieces:
+        buffered.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffered)
+            buffered, length = [], 0
+    if buffered:
+        yield ''.join(buffered)
+
+
+def generateNDJSON(session):
+    """
+    This yields the catalog as newline delimited JSON, one
+    {"Category": {...}} or {"Item": {...}} object per line.
+    """
+    for kind, data in iterCatalog(session):
+        yield dumps({kind: data}) + '\n'
+
+
+def generateJSON(session):
+    """
+    This yields the catalog as one {"Category": [...], "Item": [...]} JSON
+    document, written out a row at a time.
+    """
+    yield '{"Category":['
+    current, separator = 'Category', ''
+    for kind, data in iterCatalog(session):
+        if kind != current:
+            yield '],"Item":['
+            current, separator = kind, ''
+        yield separator + dumps(data)
+        separator = ','
+    if current == 'Category':
+        yield '],"Item":['
+    yield ']}'
@@ -0,0 +1,80 @@
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# orjson is Python 3 only.  On Python 2 simplejson's C encoder is used
+# instead; unlike the standard library's it also handles sort_keys, which
+# jsonify sets by default.
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+from flask import current_app, json, jsonify
+from werkzeug.http import http_date
+from database_setup import Item
+
+# The columns behind Item.serialize.  Querying these instead of Item returns
+# plain row tuples, so large pages skip building Item objects and the
+# session's identity map.
+ITEM_COLUMNS = (Item.id, Item.name, Item.slug, Item.description, Item.time,
+                Item.user_id, Item.category_id)
+ITEM_KEYS = tuple(column.key for column in ITEM_COLUMNS)
+TIME_INDEX = ITEM_KEYS.index('time')
+ENCODER = 'orjson' if orjson else 'simplejson' if simplejson else 'flask.json'
+
+
+def itemDict(row):
+    """
+    This turns a row of ITEM_COLUMNS into what Item.serialize returns, with
+    the time already formatted the way Flask's encoder writes datetimes.
+    """
+    data = dict(zip(ITEM_KEYS, row))
+    if row[TIME_INDEX] is not None:
+        data['time'] = http_date(row[TIME_INDEX])
+    return data
+
+
+def _encode(obj, separators):
+    """
+    This encodes obj as jsonify would, with orjson or else simplejson, and
+    returns the UTF-8 bytes.  It returns None when neither is installed or
+    the app is configured to do something they are not used for (pretty
+    printing).
+    """
+    config = current_app.config
+    if current_app.debug or config.get('JSONIFY_PRETTYPRINT_REGULAR'):
+        return None
+    sort_keys = config.get('JSON_SORT_KEYS', True)
+    if orjson is not None:
+        return orjson.dumps(obj,
+                            option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    if simplejson is not None:
+        return simplejson.dumps(obj, sort_keys=sort_keys,
+                                separators=separators).encode('utf-8')
+    return None
+
+
+def dumps(obj):
+    """
+    This is flask.json.dumps for documents made only of plain values, using
+    the fastest encoder installed.
+    """
+    body = _encode(obj, (', ', ': '))
+    if body is not None:
+        return body.decode('utf-8')
+    return json.dumps(obj)
+
+
+def jsonResponse(**data):
+    """
+    This is jsonify for documents made only of plain values, such as the
+    output of itemDict.  The document is the same; with orjson or simplejson
+    installed it is encoded several times faster, and with orjson non-ASCII
+    text is sent as UTF-8 rather than as escapes.
+    """
+    body = _encode(data, (',', ':'))
+    if body is not None:
+        return current_app.response_class(
+            body + b'\n', mimetype=current_app.config.get(
+                'JSONIFY_MIMETYPE', 'application/json'))
+    return jsonify(**data)
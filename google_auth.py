@@ -0,0 +1,176 @@
+import base64
+import json
+import os
+import re
+import threading
+import time
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import observeResponse
+
+# Google endpoints.  They can be pointed at a local stub server (see
+# benchmarks/stub_oauth.py) to exercise the whole sign in flow offline.
+CERTS_URI = os.environ.get('CATALOG_GOOGLE_CERTS_URI',
+                           'https://www.googleapis.com/oauth2/v1/certs')
+TOKENINFO_URI = os.environ.get(
+    'CATALOG_GOOGLE_TOKENINFO_URI',
+    'https://www.googleapis.com/oauth2/v1/tokeninfo')
+USERINFO_URI = os.environ.get('CATALOG_GOOGLE_USERINFO_URI',
+                              'https://www.googleapis.com/oauth2/v1/userinfo')
+REVOKE_URI = os.environ.get('CATALOG_GOOGLE_REVOKE_URI',
+                            'https://accounts.google.com/o/oauth2/revoke')
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+# Seconds to wait for Google before giving up on a request.
+HTTP_TIMEOUT = float(os.environ.get('CATALOG_HTTP_TIMEOUT', 5))
+HTTP_POOL_SIZE = int(os.environ.get('CATALOG_HTTP_POOL_SIZE', 10))
+# Used when the certs response has no usable max-age.
+DEFAULT_CERTS_TTL = 3600
+
+
+class TokenError(Exception):
+    pass
+
+
+def makeHttpSession():
+    """
+    This creates the requests session every outbound call shares, so
+    connections (and their TLS handshakes) are reused across logins.  Every
+    response's timing is recorded in the outbound HTTP metrics.
+    """
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE,
+                          max_retries=1)
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    http.hooks['response'].append(observeResponse)
+    return http
+
+
+http_session = makeHttpSession()
+
+# oauth2client needs an httplib2 client for the code exchange.  httplib2
+# objects are not thread safe, so each thread keeps its own, which still
+# keeps the connection to the token endpoint open between logins.
+_local = threading.local()
+
+
+def getHttplib2():
+    if getattr(_local, 'http', None) is None:
+        _local.http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    return _local.http
+
+
+def fetchJSON(url, **params):
+    response = http_session.get(url, params=params, timeout=HTTP_TIMEOUT)
+    return response.status_code, response.json()
+
+
+class CertCache(object):
+    """
+    This holds Google's token signing certificates for as long as Google's
+    Cache-Control header allows, so verifying an ID token normally needs no
+    outbound request at all.
+    """
+
+    def __init__(self, uri=CERTS_URI):
+        self.uri = uri
+        self.certs = None
+        self.expires = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self.certs is None or self.expires < time.time():
+                response = http_session.get(self.uri, timeout=HTTP_TIMEOUT)
+                response.raise_for_status()
+                match = re.search(r'max-age=(\d+)',
+                                  response.headers.get('Cache-Control', ''))
+                ttl = int(match.group(1)) if match else DEFAULT_CERTS_TTL
+                self.certs = response.json()
+                self.expires = time.time() + ttl
+            return self.certs
+
+
+cert_cache = CertCache()
+
+
+def signingKeyId(id_token):
+    """
+    This returns the id of the key an ID token says it was signed with.
+    """
+    header = id_token.split('.')[0]
+    header += '=' * (-len(header) % 4)
+    try:
+        return json.loads(base64.urlsafe_b64decode(str(header))
+                          .decode('utf-8')).get('kid')
+    except (TypeError, ValueError, AttributeError):
+        raise TokenError('Malformed ID token.')
+
+
+def checkTokenInfo(id_token, client_id):
+    """
+    This asks Google's tokeninfo endpoint whether an ID token is valid for
+    this app and returns its claims.
+    """
+    status, claims = fetchJSON(TOKENINFO_URI, id_token=id_token)
+    if status != 200 or claims.get('error_description') or \
+            claims.get('error'):
+        raise TokenError(claims.get('error_description') or
+                         claims.get('error') or 'Invalid ID token.')
+    if claims.get('aud') != client_id:
+        raise TokenError("Token's client ID does not match app's.")
+    return claims
+
+
+def verifyIdToken(id_token, client_id):
+    """
+    This returns the claims of a Google ID token after checking its
+    signature, audience, expiry and issuer against the cached certificates.
+    If the token cannot be checked locally (no crypto library, a certs fetch
+    failure, a signing key newer than the cached certificates) Google's
+    tokeninfo endpoint is asked instead, since it is authoritative.  A token
+    that fails the local checks is rejected.  Raises TokenError if the token
+    is not valid for this app, and requests.RequestException or ValueError
+    if Google could not be asked.
+    """
+    try:
+        from oauth2client import crypt
+        certs = cert_cache.get()
+    except (ImportError, requests.RequestException, ValueError):
+        return checkTokenInfo(id_token, client_id)
+    if signingKeyId(id_token) not in certs:
+        return checkTokenInfo(id_token, client_id)
+    try:
+        claims = crypt.verify_signed_jwt_with_certs(id_token, certs,
+                                                    client_id)
+    except crypt.AppIdentityError as e:
+        raise TokenError(e.args[0] if e.args else 'Invalid ID token.')
+    if claims.get('iss') not in ISSUERS:
+        raise TokenError("Token's issuer is not Google.")
+    return claims
+
+
+def getProfile(claims, access_token):
+    """
+    This returns the user's name, picture and email.  They are taken from the
+    ID token when it carries them and fetched from userinfo otherwise.
+    """
+    if all(claims.get(key) for key in ('name', 'picture', 'email')):
+        return {'name': claims['name'], 'picture': claims['picture'],
+                'email': claims['email']}
+    status, data = fetchJSON(USERINFO_URI, access_token=access_token,
+                             alt='json')
+    if status != 200:
+        raise TokenError('Failed to fetch user info.')
+    return data
+
+
+def revokeToken(access_token):
+    """
+    This revokes an access token, returning True if Google accepted it.
+    """
+    response = http_session.get(REVOKE_URI, params={'token': access_token},
+                                timeout=HTTP_TIMEOUT)
+    return response.status_code == 200
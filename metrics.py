@@ -0,0 +1,300 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from flask import Response, signals, template_rendered
+try:
+    from flask import before_render_template
+except ImportError:
+    # Added in Flask 0.11.
+    before_render_template = None
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Requests slower than this many seconds are logged together with the SQL
+# they ran.  The slow request log is off while it is 0.
+SLOW_REQUEST_SECONDS = float(
+    os.environ.get('CATALOG_SLOW_REQUEST_SECONDS', 0))
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+slow_log = logging.getLogger('catalog.slow_requests')
+
+
+def formatLabels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\')
+                     .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values))
+
+
+class Metric(object):
+    """
+    The parts shared by every metric: a name, help text, label names and a
+    lock protecting the per-label-set values.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def header(self):
+        return ['# HELP %s %s' % (self.name, self.documentation),
+                '# TYPE %s %s' % (self.name, self.kind)]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            return self.header() + [
+                '%s%s %s' % (self.name, formatLabels(self.labels, key), value)
+                for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts, total, count = self.values.get(key) or (
+                [0] * len(self.buckets), 0.0, 0)
+            counts = [bucket_count + (value <= bound)
+                      for bucket_count, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append('%s_bucket%s %d' % (
+                        self.name,
+                        formatLabels(self.labels + ('le',), key + (bound,)),
+                        bucket_count))
+                lines.append('%s_bucket%s %d' % (
+                    self.name, formatLabels(self.labels + ('le',),
+                                            key + ('+Inf',)), count))
+                lines.append('%s_sum%s %s' % (
+                    self.name, formatLabels(self.labels, key), total))
+                lines.append('%s_count%s %d' % (
+                    self.name, formatLabels(self.labels, key), count))
+        return lines
+
+
+REGISTRY = []
+
+REQUEST_DURATION = Histogram(
+    'catalog_request_duration_seconds', 'Time spent handling requests.',
+    ['endpoint', 'method', 'status'])
+SQL_DURATION = Histogram(
+    'catalog_sql_duration_seconds', 'Time spent executing SQL statements.',
+    ['operation'])
+SQL_STATEMENTS = Counter(
+    'catalog_sql_statements_total', 'SQL statements executed.',
+    ['endpoint', 'operation', 'database'])
+TEMPLATE_DURATION = Histogram(
+    'catalog_template_render_seconds', 'Time spent rendering templates.',
+    ['template'])
+OUTBOUND_DURATION = Histogram(
+    'catalog_outbound_http_seconds', 'Time spent on outbound HTTP calls.',
+    ['target', 'status'])
+POOL_CHECKOUT_WAIT = Histogram(
+    'catalog_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the pool.')
+POOL_CONNECTIONS = Gauge(
+    'catalog_db_pool_connections', 'Pool connections by state.', ['state'])
+CACHE_EVENTS = Gauge(
+    'catalog_cache_events', 'Cache hits, misses, evictions and size.',
+    ['cache', 'event'])
+REQUESTS_SHED = Counter(
+    'catalog_requests_shed_total',
+    'Requests refused by rate limiting (429) or load shedding (503).',
+    ['route_class', 'reason'])
+REQUESTS_IN_FLIGHT = Gauge(
+    'catalog_requests_in_flight',
+    'Requests holding one of the admission control slots.')
+
+# Called at scrape time to refresh gauges that mirror other objects' state,
+# keyed by what they watch so creating another app replaces rather than
+# duplicates them.
+collectors = {}
+
+
+def render():
+    for collect in list(collectors.values()):
+        collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def watchCache(name, cache):
+    """
+    This exports a TTLCache's hit, miss and eviction counts and its size.
+    """
+    def collect():
+        for kind, value in cache.stats().items():
+            CACHE_EVENTS.set(value, cache=name, event=kind)
+    collectors[('cache', name)] = collect
+
+
+def watchPool(getPool):
+    """
+    This exports how many of a QueuePool's connections are in use, idle and
+    opened beyond pool_size.  getPool is called at scrape time, since the
+    engine may not exist yet when the app is set up.
+    """
+    def collect():
+        pool = getPool()
+        if hasattr(pool, 'checkedout'):
+            POOL_CONNECTIONS.set(pool.checkedout(), state='checked_out')
+            POOL_CONNECTIONS.set(pool.checkedin(), state='idle')
+            POOL_CONNECTIONS.set(max(pool.overflow(), 0), state='overflow')
+    collectors['pool'] = collect
+
+
+@contextmanager
+def timeOutbound(target):
+    """
+    This times an outbound call that does not go through the shared
+    requests session, such as oauth2client's code exchange.
+    """
+    start = time.time()
+    status = 'error'
+    try:
+        yield
+        status = 'ok'
+    finally:
+        OUTBOUND_DURATION.observe(time.time() - start, target=target,
+                                  status=status)
+
+
+def observeResponse(response, *args, **kwargs):
+    # A requests response hook for the shared outbound session.
+    OUTBOUND_DURATION.observe(response.elapsed.total_seconds(),
+                              target=response.url.split('?')[0],
+                              status=response.status_code)
+
+
+def statementOperation(statement):
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else ''
+
+
+# Every engine's statements are timed, whichever database it belongs to.
+@event.listens_for(Engine, 'before_cursor_execute')
+def startStatement(conn, cursor, statement, parameters, context,
+                   executemany):
+    conn.info.setdefault('statement_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def endStatement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.time() - conn.info['statement_start'].pop()
+    operation = statementOperation(statement)
+    SQL_DURATION.observe(elapsed, operation=operation)
+    endpoint = ''
+    if has_request_context():
+        endpoint = request.endpoint or ''
+    # Kept only for the slow request log.
+    if SLOW_REQUEST_SECONDS and has_request_context():
+        if not hasattr(g, 'sql_log'):
+            g.sql_log = []
+        g.sql_log.append((elapsed, statement))
+    # The database label tells the primary's statements from the replicas'.
+    SQL_STATEMENTS.inc(endpoint=endpoint, operation=operation,
+                       database=conn.engine.url.database or '')
+
+
+def init_app(app):
+    """
+    This instruments the app's requests and templates, and serves everything
+    recorded at /metrics in the Prometheus text format.  Template timings
+    need Flask 0.11 or later and the blinker package; without them they are
+    not recorded.
+    """
+    watchPool(lambda: app.extensions['catalog_database'].engine.pool)
+
+    def startTemplate(sender, template, context, **extra):
+        if not hasattr(g, 'template_start'):
+            g.template_start = []
+        g.template_start.append(time.time())
+
+    def endTemplate(sender, template, context, **extra):
+        starts = getattr(g, 'template_start', None)
+        if starts:
+            TEMPLATE_DURATION.observe(time.time() - starts.pop(),
+                                      template=template.name)
+
+    if signals.signals_available and before_render_template is not None:
+        before_render_template.connect(startTemplate, app)
+        template_rendered.connect(endTemplate, app)
+        # Keep references so the weakly connected receivers stay alive.
+        app.extensions['catalog_metrics'] = (startTemplate, endTemplate)
+
+    @app.before_request
+    def startRequest():
+        g.request_start = time.time()
+
+    @app.after_request
+    def recordStatus(response):
+        g.response_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def endRequest(exception=None):
+        start = getattr(g, 'request_start', None)
+        if start is None:
+            return
+        elapsed = time.time() - start
+        REQUEST_DURATION.observe(
+            elapsed, endpoint=request.endpoint or '', method=request.method,
+            status=getattr(g, 'response_status', 500))
+        if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+            statements = getattr(g, 'sql_log', [])
+            slow_log.warning(
+                'Slow request: %s %s took %.3fs with %d SQL statements:\n%s',
+                request.method, request.full_path, elapsed, len(statements),
+                '\n'.join('  %.4fs %s' % (duration, ' '.join(sql.split()))
+                          for duration, sql in statements))
+
+    @app.route('/metrics')
+    def metrics():
+        """
+        This returns every recorded metric in the Prometheus text format.
+        """
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,234 @@
+"""
+Versioned schema migrations for the catalog database.
+
+    python migrations.py upgrade     apply every pending migration
+    python migrations.py current     print the database's schema version
+    python migrations.py history     list the known migrations
+
+Each migration runs in its own transaction together with the update of the
+schema_version table, so a failed migration leaves the version unchanged.
+Migrations check for what already exists, which lets a brand new database and
+a database created by the old create_all() call both upgrade cleanly.
+"""
+import sys
+from datetime import datetime
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData
+from sqlalchemy import String, Table
+from sqlalchemy import bindparam, inspect, select, text
+from database import get_engine
+from database_setup import Base, Category, Item, CatalogState
+from database_setup import ItemChange
+from search import SEARCH_VECTOR_SQL, rebuildSearchIndex
+from slugs import RESERVED_SLUGS, slugify, uniqueSlug
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    This registers the decorated function as the migration that brings the
+    schema to the given version.
+    """
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return decorator
+
+
+def createIndex(conn, name, table, columns, unique=False):
+    """
+    This creates an index unless one with the same name already exists.
+    Both Postgres and SQLite understand CREATE INDEX IF NOT EXISTS.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(text('CREATE %sINDEX IF NOT EXISTS %s ON %s (%s)' % (
+        'UNIQUE ' if unique else '', quote(name), quote(table),
+        ', '.join(quote(column) for column in columns))))
+
+
+def hasColumn(conn, table, column):
+    return column in [c['name'] for c in inspect(conn).get_columns(table)]
+
+
+# The tables as the original create_all() call made them.  Migration 1
+# creates exactly these, not the current models, so a new database goes
+# through the same steps as an old one and ends up with the same schema.
+baseline = MetaData()
+Table('user', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('email', String(250), nullable=False),
+      Column('name', String(250)),
+      Column('picture', String(250)))
+Table('category', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('name', String(250), nullable=False))
+Table('item', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('name', String(250), nullable=False),
+      Column('description', String(2000)),
+      Column('time', DateTime),
+      Column('user_id', Integer, ForeignKey('user.id')),
+      Column('category_id', Integer, ForeignKey('category.id')))
+
+
+@migration(1, 'create the user, category and item tables')
+def createBaseTables(conn):
+    baseline.create_all(conn)
+
+
+@migration(2, 'index the lookup and sort columns')
+def addLookupIndexes(conn):
+    createIndex(conn, 'ix_user_email', 'user', ['email'], unique=True)
+    createIndex(conn, 'ix_category_name', 'category', ['name'], unique=True)
+    createIndex(conn, 'ix_item_category_id_name', 'item',
+                ['category_id', 'name'], unique=True)
+    createIndex(conn, 'ix_item_time', 'item', ['time'])
+
+
+@migration(3, 'index items in category page order')
+def addItemPageIndex(conn):
+    # Superseded by migration 8, which drops this index again.
+    createIndex(conn, 'ix_item_category_id_name_id', 'item',
+                ['category_id', 'name', 'id'])
+
+
+@migration(4, 'track the catalog version for conditional GETs')
+def addCatalogState(conn):
+    Base.metadata.create_all(conn, tables=[CatalogState.__table__])
+    table = CatalogState.__table__
+    if conn.execute(table.select()).first() is None:
+        conn.execute(table.insert(), id=1, version=1,
+                     modified=datetime.utcnow())
+
+
+@migration(5, 'add the full text item search index')
+def addSearchIndex(conn):
+    if conn.dialect.name == 'sqlite':
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master "
+                                   "WHERE name = 'item_search'")).first()
+        if exists is None:
+            conn.execute(text('CREATE VIRTUAL TABLE item_search '
+                              'USING fts5(name, description)'))
+            rebuildSearchIndex(conn)
+    else:
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_item_search ON item '
+                          'USING gin (%s)' % SEARCH_VECTOR_SQL))
+
+
+def backfillSlugs(conn, table, kind, scope=None):
+    """
+    This gives every row of table without a slug one made from its name,
+    unique among the rows with the same scope column value (or the whole
+    table).  Rows are numbered in id order, so the oldest row gets the plain
+    slug when two names collide.
+    """
+    columns = [table.c.id, table.c.name, table.c.slug]
+    if scope:
+        columns.append(table.c[scope])
+    taken = {}
+    missing = []
+    for row in conn.execute(select(columns).order_by(table.c.id)):
+        key = row[scope] if scope else None
+        if row.slug is None:
+            missing.append((row.id, row.name, key))
+        else:
+            taken.setdefault(key, set()).add(row.slug)
+    updates = []
+    for row_id, name, key in missing:
+        slug = uniqueSlug(slugify(name, kind), taken.setdefault(key, set()))
+        taken[key].add(slug)
+        updates.append({'row_id': row_id, 'new_slug': slug})
+    if updates:
+        conn.execute(table.update().where(table.c.id == bindparam('row_id'))
+                     .values(slug=bindparam('new_slug')), updates)
+
+
+@migration(6, 'add URL slugs to categories and items')
+def addSlugs(conn):
+    for table in ('category', 'item'):
+        if not hasColumn(conn, table, 'slug'):
+            conn.execute(text(
+                'ALTER TABLE %s ADD COLUMN slug VARCHAR(250)'
+                % conn.dialect.identifier_preparer.quote(table)))
+    backfillSlugs(conn, Category.__table__, 'category')
+    backfillSlugs(conn, Item.__table__, 'item', scope='category_id')
+    createIndex(conn, 'ix_category_slug', 'category', ['slug'], unique=True)
+    createIndex(conn, 'ix_item_category_id_slug', 'item',
+                ['category_id', 'slug'], unique=True)
+
+
+@migration(7, 'log item changes for the change feed')
+def addItemChanges(conn):
+    Base.metadata.create_all(conn, tables=[ItemChange.__table__])
+
+
+@migration(8, 'drop the redundant item page index')
+def dropItemPageIndex(conn):
+    # The unique (category_id, name) index already serves the category page
+    # seeks, since names are unique within a category.
+    conn.execute(text('DROP INDEX IF EXISTS ix_item_category_id_name_id'))
+
+
+@migration(9, 'move slugs off the words the routes reserve')
+def renameReservedSlugs(conn):
+    for table, kind, scope in ((Category.__table__, 'category', None),
+                               (Item.__table__, 'item', 'category_id')):
+        conn.execute(table.update()
+                     .where(table.c.slug.in_(sorted(RESERVED_SLUGS)))
+                     .values(slug=None))
+        backfillSlugs(conn, table, kind, scope=scope)
+
+
+def currentVersion(conn):
+    """
+    This returns the version recorded in schema_version, creating the table
+    the first time it is needed.
+    """
+    conn.execute(text('CREATE TABLE IF NOT EXISTS schema_version '
+                      '(version INTEGER NOT NULL)'))
+    version = conn.execute(text('SELECT MAX(version) FROM schema_version'))\
+        .scalar()
+    return version or 0
+
+
+def upgrade(bind=None, target=None):
+    """
+    This applies every migration newer than the database's current version,
+    up to and including target when it is given.  It returns the version the
+    database ends up at.
+    """
+    bind = bind or get_engine()
+    with bind.begin() as conn:
+        version = currentVersion(conn)
+    for number, description, apply in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        with bind.begin() as conn:
+            apply(conn)
+            conn.execute(text('DELETE FROM schema_version'))
+            conn.execute(text('INSERT INTO schema_version (version) '
+                              'VALUES (:version)'), version=number)
+        print('Applied migration %d: %s' % (number, description))
+        version = number
+    return version
+
+
+def main(argv):
+    command = argv[0] if argv else 'upgrade'
+    if command == 'upgrade':
+        print('Schema is at version %d' % upgrade())
+    elif command == 'current':
+        with get_engine().begin() as conn:
+            print(currentVersion(conn))
+    elif command == 'history':
+        for number, description, apply in MIGRATIONS:
+            print('%3d  %s' % (number, description))
+    else:
+        print(__doc__.strip())
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,75 @@
+import os
+from functools import wraps
+from flask import g, request, make_response, render_template, Response
+from flask import session as login_session
+from markupsafe import Markup
+from cache import TTLCache, getCategories
+from conditional import getCatalogState
+
+PAGE_CACHE_TTL = int(os.environ.get('CATALOG_PAGE_CACHE_TTL', 300))
+PAGE_CACHE_SIZE = int(os.environ.get('CATALOG_PAGE_CACHE_SIZE', 1000))
+
+# Rendered pages keyed by endpoint, full path (route arguments and query
+# string) and catalog version.  Only anonymous requests are served from it;
+# logged in users get per-user controls, so their pages reuse the cached
+# fragments instead.  The version in the keys makes every process miss once
+# any process has written, since tag invalidation only reaches the process
+# that made the write; it also keeps a page rendered before a write from
+# being served under the ETag of the version after it.
+page_cache = TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL)
+
+
+def tagPage(*tags):
+    """
+    This records what data the page being rendered was built from, e.g.
+    'category:3' or 'item:12', so writes can drop exactly the pages that
+    showed it.
+    """
+    g.page_tags = getattr(g, 'page_tags', ()) + tags
+
+
+def invalidatePages(*tags):
+    """
+    This drops every cached page and fragment tagged with any of tags.
+    """
+    page_cache.invalidate_tags(*tags)
+
+
+def cachedPage(f):
+    """
+    This decorator serves anonymous GET requests for a view from the page
+    cache, rendering and storing the page on a miss.  Only plain 200
+    responses that do not set a cookie are stored.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET' or 'user_id' in login_session:
+            return f(*args, **kwargs)
+        key = ('page', request.endpoint, request.full_path,
+               getCatalogState()[0])
+        cached = page_cache.get(key)
+        if cached is not None:
+            body, mimetype = cached
+            return Response(body, mimetype=mimetype)
+        g.page_tags = ()
+        response = make_response(f(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed \
+                and 'Set-Cookie' not in response.headers:
+            page_cache.set(key, (response.get_data(), response.mimetype),
+                           tags=g.page_tags)
+        return response
+    return decorated_function
+
+
+def renderCategorySidebar():
+    """
+    This returns the category navigation sidebar, rendered once and shared
+    by every page and every user until the catalog changes.
+    """
+    key = ('fragment', 'category_sidebar', getCatalogState()[0])
+    html = page_cache.get(key)
+    if html is None:
+        html = render_template('_category_sidebar.html',
+                               categories=getCategories())
+        page_cache.set(key, html, tags=['categories'])
+    return Markup(html)
@@ -0,0 +1,78 @@
+import base64
+import json
+import os
+from sqlalchemy import and_, or_
+
+PAGE_SIZE = int(os.environ.get('CATALOG_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('CATALOG_MAX_PAGE_SIZE', 200))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encodeCursor(values):
+    """
+    This packs the sort key of the last row on a page into an opaque,
+    URL safe string.
+    """
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decodeCursor(cursor):
+    """
+    This unpacks a cursor made by encodeCursor, raising InvalidCursor if the
+    client sent something else.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii'))
+                            .decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def pageSize(requested):
+    """
+    This turns the limit a client asked for into a page size between 1 and
+    MAX_PAGE_SIZE, falling back to PAGE_SIZE when none (or junk) was given.
+    """
+    try:
+        size = int(requested)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keysetPage(query, columns, cursor=None, limit=PAGE_SIZE):
+    """
+    This returns one page of query, ordered by columns, starting after the
+    row the cursor points at, together with the cursor for the next page (or
+    None on the last page).  The rows must expose each column under its key.
+
+    Seeking past the previous page's last key instead of using OFFSET lets
+    the database start from the index position directly, so a deep page
+    costs the same as the first one.
+    """
+    if cursor:
+        values = decodeCursor(cursor)
+        if len(values) != len(columns):
+            raise InvalidCursor(cursor)
+        # (a, b) > (x, y) expanded, plus a >= x so the leading column can
+        # still be used as an index range condition.
+        alternatives = []
+        for i, column in enumerate(columns):
+            equal = [columns[j] == values[j] for j in range(i)]
+            alternatives.append(and_(*(equal + [column > values[i]])))
+        query = query.filter(columns[0] >= values[0], or_(*alternatives))
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encodeCursor([getattr(rows[-1], column.key)
+                                    for column in columns])
+    return rows, next_cursor
@@ -0,0 +1,265 @@
+"""
+Pre-renders the pages anonymous visitors see, and the JSON endpoints, to a
+directory the web server can serve without running the app.
+
+    python publish.py /var/www/catalog_static --processes 4
+
+This renders the home page, every category page and item page and their
+JSON endpoints through the app itself, spread over a pool of processes, and
+removes published files for categories and items that no longer exist.
+Only those files under catalog/ are ever removed, so the directory may be
+shared with other content, such as the web server's document root.
+Only the first page of each category is published; URLs with a query
+string, the search pages and the exports are always served by the app.
+
+When the app is created with PUBLISH_DIR (CATALOG_PUBLISH_DIR) set, every
+item create, edit or delete re-renders just the pages that showed the item
+on a background thread.  Writes made outside the app, such as bulk loads,
+need a full rebuild afterwards.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from multiprocessing import Pool
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from flask import current_app
+
+PUBLISH_DIR = os.environ.get('CATALOG_PUBLISH_DIR')
+# Paths sent to each pool process at a time during a full rebuild.
+REBUILD_CHUNK_SIZE = 200
+
+publish_log = logging.getLogger('catalog.publish')
+
+
+def homePaths():
+    return ['/', '/catalog/']
+
+
+def categoryPaths(category_slug):
+    return ['/catalog/%s/' % category_slug,
+            '/catalog/%s/JSON' % category_slug]
+
+
+def itemPaths(category_slug, item_slug):
+    return ['/catalog/%s/%s/' % (category_slug, item_slug),
+            '/catalog/%s/%s/JSON' % (category_slug, item_slug)]
+
+
+def filePath(directory, path):
+    """
+    This returns the file a URL path is published to: index.html inside the
+    path's directory for pages and <path>.json for the JSON endpoints.
+    """
+    if path.endswith('/'):
+        path += 'index.html'
+    else:
+        path += '.json'
+    return os.path.join(directory, *path.strip('/').split('/'))
+
+
+def publishPath(client, directory, path):
+    """
+    This renders path as an anonymous visitor would see it and writes it to
+    its file, or removes the file when the path no longer renders (e.g. the
+    item was deleted or renamed).  It returns the file if one was written.
+    """
+    target = filePath(directory, path)
+    # Marked as internal so rate limits do not apply.
+    response = client.get(path, environ_overrides={'catalog.internal': True})
+    if response.status_code != 200 or 'Set-Cookie' in response.headers:
+        if os.path.exists(target):
+            os.remove(target)
+        return None
+    if not os.path.isdir(os.path.dirname(target)):
+        try:
+            os.makedirs(os.path.dirname(target))
+        except OSError:
+            # Another process created it first.
+            if not os.path.isdir(os.path.dirname(target)):
+                raise
+    # Write next to the target and rename, so the web server never serves a
+    # half written file.
+    partial = '%s.%d.%d.tmp' % (target, os.getpid(),
+                                threading.current_thread().ident)
+    with open(partial, 'wb') as f:
+        f.write(response.get_data())
+    os.rename(partial, target)
+    return target
+
+
+class Publisher(object):
+    """
+    This re-renders published paths on a background thread.  Paths
+    scheduled while the thread is busy are merged, so a burst of writes to
+    one category renders its page once.  The thread is started on first use
+    in each process, since threads do not survive a fork.
+    """
+
+    def __init__(self, app, directory):
+        self.app = app
+        self.directory = directory
+        self.queue = Queue()
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def schedule(self, paths):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.queue = Queue()
+                thread = threading.Thread(target=self.run)
+                thread.daemon = True
+                thread.start()
+                self.pid = os.getpid()
+        self.queue.put(list(paths))
+
+    def run(self):
+        queue = self.queue
+        client = self.app.test_client()
+        while True:
+            paths = queue.get()
+            while not queue.empty():
+                paths.extend(queue.get())
+            start = time.time()
+            for path in sorted(set(paths)):
+                try:
+                    publishPath(client, self.directory, path)
+                except Exception:
+                    publish_log.exception('Could not publish %s', path)
+            publish_log.debug('Published %d paths in %.3fs', len(set(paths)),
+                              time.time() - start)
+
+
+def init_app(app):
+    """
+    This gives the app a Publisher when PUBLISH_DIR is set.
+    """
+    directory = app.config.get('PUBLISH_DIR', PUBLISH_DIR)
+    if directory:
+        app.extensions['catalog_publisher'] = Publisher(app, directory)
+
+
+def scheduleItem(category_slug, *item_slugs):
+    """
+    This re-renders, in the background, the pages that show an item in the
+    given category under any of item_slugs (its old and new slug after a
+    rename).  It does nothing unless publishing is enabled.
+    """
+    publisher = current_app.extensions.get('catalog_publisher')
+    if publisher is None:
+        return
+    paths = homePaths() + categoryPaths(category_slug)
+    for item_slug in item_slugs:
+        paths.extend(itemPaths(category_slug, item_slug))
+    publisher.schedule(paths)
+
+
+def allPaths(session):
+    """
+    This returns every path a full rebuild publishes.
+    """
+    from database_setup import Category, Item
+    paths = homePaths()
+    for category_slug, in session.query(Category.slug):
+        paths.extend(categoryPaths(category_slug))
+    query = session.query(Category.slug, Item.slug)\
+        .join(Item, Item.category_id == Category.id)
+    for category_slug, item_slug in query:
+        paths.extend(itemPaths(category_slug, item_slug))
+    return paths
+
+
+# Set in each pool process by startWorker.
+_worker = {}
+
+
+def startWorker(config, directory):
+    from project import create_app
+    _worker['client'] = create_app(config).test_client()
+    _worker['directory'] = directory
+
+
+def publishChunk(paths):
+    return [publishPath(_worker['client'], _worker['directory'], path)
+            for path in paths]
+
+
+def managedFiles(directory):
+    """
+    This returns the category and item files published under directory's
+    catalog/ folder: the index.html and JSON.json of each category and item
+    directory.  Nothing else in directory is the publisher's, e.g. when it
+    is the web server's document root.
+    """
+    def published(folder):
+        return [path for path in (os.path.join(folder, 'index.html'),
+                                  os.path.join(folder, 'JSON.json'))
+                if os.path.isfile(path)]
+
+    root = os.path.join(directory, 'catalog')
+    files = []
+    if not os.path.isdir(root):
+        return files
+    for category in os.listdir(root):
+        category_dir = os.path.join(root, category)
+        if not os.path.isdir(category_dir):
+            continue
+        files.extend(published(category_dir))
+        for item in os.listdir(category_dir):
+            item_dir = os.path.join(category_dir, item)
+            if os.path.isdir(item_dir):
+                files.extend(published(item_dir))
+    return files
+
+
+def rebuild(directory, processes=None, config=None):
+    """
+    This publishes every path to directory using a pool of processes and
+    then removes the published files of categories and items that no
+    longer exist.  It returns the number of files written.
+    """
+    from database import DBSession
+    from project import create_app
+    config = dict(config or {}, PUBLISH_DIR=None)
+    with create_app(config).app_context():
+        paths = allPaths(DBSession())
+    chunks = [paths[start:start + REBUILD_CHUNK_SIZE]
+              for start in range(0, len(paths), REBUILD_CHUNK_SIZE)]
+    pool = Pool(processes, startWorker, (config, directory))
+    try:
+        written = set()
+        for files in pool.imap_unordered(publishChunk, chunks):
+            written.update(f for f in files if f)
+    finally:
+        pool.close()
+        pool.join()
+    for path in managedFiles(directory):
+        if path not in written:
+            os.remove(path)
+    return len(written)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=PUBLISH_DIR)
+    parser.add_argument('--processes', type=int,
+                        help='pool size (default: one per CPU)')
+    args = parser.parse_args(argv)
+    if not args.directory:
+        parser.error('give a directory or set CATALOG_PUBLISH_DIR')
+    start = time.time()
+    count = rebuild(os.path.abspath(args.directory), args.processes)
+    print('Published %d files in %.1fs' % (count, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,311 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from flask import g, jsonify, request, Response
+from flask import session as login_session
+from metrics import REQUESTS_SHED, REQUESTS_IN_FLIGHT
+
+# Token bucket limits per route class as "class=rate/burst" pairs, e.g.
+# "json=5/20,html=10/30,auth=0.2/5,write=1/10": each client may make rate
+# requests a second of that class on average and burst requests at once.
+# Classes without a limit are not rate limited; nothing is by default.
+RATE_LIMITS = os.environ.get('CATALOG_RATE_LIMITS', '')
+# Where the buckets live: "memory" for each process on its own, or
+# "sqlite:///path" for a file shared by every process on the host.
+RATE_LIMIT_BACKEND = os.environ.get('CATALOG_RATE_LIMIT_BACKEND', 'memory')
+# The most requests served at once by each process, and how long a request
+# may wait for a slot before it is refused.  Off while MAX_IN_FLIGHT is 0.
+MAX_IN_FLIGHT = int(os.environ.get('CATALOG_MAX_IN_FLIGHT', 0))
+ADMISSION_TIMEOUT = float(os.environ.get('CATALOG_ADMISSION_TIMEOUT', 0.1))
+# How many reverse proxies in front of the app append to X-Forwarded-For.
+# Anonymous clients are then limited by the address the outermost of them
+# saw instead of by the proxy's own address.  Leave it at 0 when clients
+# connect directly, or they could pick their address with the header.
+TRUSTED_PROXIES = int(os.environ.get('CATALOG_TRUSTED_PROXIES', 0))
+
+# Views that are never limited.
+EXEMPT_ENDPOINTS = frozenset(['static', 'metrics'])
+# Long polls release their database connection while they wait, so they do
+# not take an admission slot.
+UNADMITTED_ENDPOINTS = frozenset(['catalog.jsonChanges'])
+AUTH_ENDPOINTS = frozenset(['catalog.login', 'catalog.gconnect',
+                            'catalog.gdisconnect'])
+
+ratelimit_log = logging.getLogger('catalog.ratelimit')
+
+
+def parseLimits(value):
+    """
+    This turns "json=5/20,html=10/30" into {'json': (5.0, 20.0), ...}.  It
+    raises ValueError for a rate that is not positive or a burst under 1,
+    which would refuse every request of the class.
+    """
+    if isinstance(value, dict):
+        limits = dict(value)
+    else:
+        limits = {}
+        for part in filter(None, value.replace(' ', '').split(',')):
+            route_class, _, limit = part.partition('=')
+            rate, _, burst = limit.partition('/')
+            limits[route_class] = (float(rate), float(burst or rate))
+    for route_class, (rate, burst) in limits.items():
+        if rate <= 0 or burst < 1:
+            raise ValueError('Invalid rate limit for %s: rate must be above '
+                             '0 and burst at least 1' % route_class)
+    return limits
+
+
+def refill(tokens, updated, rate, burst, now):
+    """
+    This returns how many tokens a bucket holds at now.  A bucket seen for
+    the first time (tokens is None) starts full.
+    """
+    if tokens is None:
+        return burst
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryBackend(object):
+    """
+    Token buckets held in this process.  Buckets idle for an hour are
+    dropped now and then; they have refilled by then, and a full bucket is
+    what a new client gets anyway.
+    """
+
+    def __init__(self, prune_every=10000):
+        self.buckets = {}
+        self.prune_every = prune_every
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """
+        This takes a token from the bucket for key and returns 0, or, when
+        the bucket is empty, the seconds until it holds a token again.
+        """
+        now = time.time()
+        with self.lock:
+            self.calls += 1
+            if self.calls % self.prune_every == 0:
+                self.prune(now)
+            tokens, updated = self.buckets.get(key, (None, now))
+            tokens = refill(tokens, updated, rate, burst, now)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+
+    def prune(self, now):
+        for key in [key for key, (tokens, updated) in self.buckets.items()
+                    if now - updated > 3600]:
+            del self.buckets[key]
+
+
+class SQLiteBackend(object):
+    """
+    Token buckets kept in a SQLite file, so every process on the host (e.g.
+    each mod_wsgi daemon process) shares the same limits.  Each thread uses
+    its own connection.
+    """
+
+    def __init__(self, path, prune_every=10000):
+        self.path = path
+        self.prune_every = prune_every
+        self.calls = 0
+        self.local = threading.local()
+
+    def connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT '
+                         'PRIMARY KEY, tokens REAL, updated REAL)')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, rate, burst):
+        conn = self.connect()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes
+        # cannot both spend the same token.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM bucket '
+                               'WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row or (None, now)
+            tokens = refill(tokens, updated, rate, burst, now)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            conn.execute('INSERT OR REPLACE INTO bucket (key, tokens, '
+                         'updated) VALUES (?, ?, ?)',
+                         (key, tokens - 1 if not wait else tokens, now))
+            self.calls += 1
+            if self.calls % self.prune_every == 0:
+                conn.execute('DELETE FROM bucket WHERE updated < ?',
+                             (now - 3600,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+def makeBackend(spec):
+    """
+    This returns the backend a RATE_LIMIT_BACKEND setting names.  Anything
+    with a take(key, rate, burst) method can be given instead.
+    """
+    if hasattr(spec, 'take'):
+        return spec
+    if spec == 'memory':
+        return MemoryBackend()
+    if spec.startswith('sqlite:///'):
+        return SQLiteBackend(spec[len('sqlite:///'):])
+    raise ValueError('Unknown rate limit backend %r' % spec)
+
+
+class Admission(object):
+    """
+    This bounds how many requests are served at once.  A request waits at
+    most timeout seconds for a slot; refusing the rest straight away keeps
+    the ones admitted fast instead of letting every request queue for a
+    database connection.
+    """
+
+    def __init__(self, limit, timeout):
+        self.limit = limit
+        self.timeout = timeout
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        with self.condition:
+            while self.in_flight >= self.limit:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            self.in_flight += 1
+            REQUESTS_IN_FLIGHT.set(self.in_flight)
+            return True
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            REQUESTS_IN_FLIGHT.set(self.in_flight)
+            self.condition.notify()
+
+
+def routeClass():
+    """
+    This returns the class of the current request: 'auth' for the login
+    flow, 'write' for anything that is not a GET, 'json' for the JSON
+    endpoints and 'html' for the pages.
+    """
+    if request.endpoint in AUTH_ENDPOINTS:
+        return 'auth'
+    if request.method not in ('GET', 'HEAD'):
+        return 'write'
+    if request.path.endswith('JSON') or \
+            request.path.startswith(('/api/', '/changes')):
+        return 'json'
+    return 'html'
+
+
+def clientAddress(trusted_proxies):
+    """
+    This returns the address a request came from.  Each of the
+    trusted_proxies proxies appends the address it received the request
+    from to X-Forwarded-For, so the client's is that many entries from the
+    end; entries before it may have been sent by the client itself.
+    """
+    if trusted_proxies:
+        forwarded = [address.strip() for address in
+                     request.headers.get('X-Forwarded-For', '').split(',')
+                     if address.strip()]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return request.remote_addr
+
+
+def clientKey(trusted_proxies=0):
+    """
+    This identifies who a request counts against: the logged in user, or
+    else the address it came from.
+    """
+    if 'user_id' in login_session:
+        return 'user:%s' % login_session['user_id']
+    return 'ip:%s' % clientAddress(trusted_proxies)
+
+
+def refuse(route_class, reason, status, message, retry_after):
+    REQUESTS_SHED.inc(route_class=route_class, reason=reason)
+    if route_class == 'html':
+        response = Response(message + '\n', mimetype='text/plain')
+    else:
+        response = jsonify(error=message)
+    response.status_code = status
+    response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+    return response
+
+
+def init_app(app):
+    """
+    This puts rate limiting and admission control in front of the app's
+    views as configured by its RATE_LIMITS, RATE_LIMIT_BACKEND,
+    TRUSTED_PROXIES, MAX_IN_FLIGHT and ADMISSION_TIMEOUT settings.  Requests
+    over their class's rate get a 429 and requests that find every slot
+    taken get a 503, both with a Retry-After header, before any view code or
+    query runs.
+    """
+    config = app.config
+    limits = parseLimits(config.get('RATE_LIMITS', RATE_LIMITS))
+    backend = makeBackend(config.get('RATE_LIMIT_BACKEND',
+                                     RATE_LIMIT_BACKEND))
+    trusted_proxies = config.get('TRUSTED_PROXIES', TRUSTED_PROXIES)
+    max_in_flight = config.get('MAX_IN_FLIGHT', MAX_IN_FLIGHT)
+    admission = None
+    if max_in_flight:
+        admission = Admission(max_in_flight, config.get(
+            'ADMISSION_TIMEOUT', ADMISSION_TIMEOUT))
+    if not limits and admission is None:
+        return
+
+    @app.before_request
+    def admitRequest():
+        # Pages rendered by the publisher are not client traffic.
+        if request.endpoint in EXEMPT_ENDPOINTS or \
+                request.environ.get('catalog.internal'):
+            return None
+        route_class = routeClass()
+        if route_class in limits:
+            rate, burst = limits[route_class]
+            try:
+                wait = backend.take('%s|%s' % (
+                    route_class, clientKey(trusted_proxies)), rate, burst)
+            except Exception:
+                # A broken backend should not take the site down with it.
+                ratelimit_log.exception('Rate limit backend failed')
+                wait = 0
+            if wait:
+                return refuse(route_class, 'rate_limited', 429,
+                              'Too many requests', wait)
+        if admission is not None and \
+                request.endpoint not in UNADMITTED_ENDPOINTS:
+            if not admission.acquire():
+                return refuse(route_class, 'overloaded', 503,
+                              'Server busy, try again shortly', 1)
+            g.admitted = True
+        return None
+
+    @app.teardown_request
+    def releaseRequest(exception=None):
+        if getattr(g, 'admitted', False):
+            g.admitted = False
+            admission.release()
@@ -0,0 +1,99 @@
+import re
+from sqlalchemy import Column, Integer, MetaData, Table, desc, func, text
+from sqlalchemy import literal_column
+from sqlalchemy.orm import contains_eager
+from database_setup import Item
+
+# Postgres searches an expression GIN index over this vector, so queries must
+# use exactly the same expression as the index for the planner to match it.
+SEARCH_VECTOR_SQL = ("to_tsvector('english', coalesce(item.name, '') || ' ' "
+                     "|| coalesce(item.description, ''))")
+
+# SQLite keeps its own copy of the searchable text in an FTS5 table whose
+# rowid is the item id.  It is not part of Base.metadata; migrations.py
+# creates it.
+item_search = Table('item_search', MetaData(), Column('rowid', Integer))
+
+
+def searchTerms(query):
+    """
+    This splits a user's query into plain words, dropping any punctuation
+    that the full text query syntaxes would otherwise interpret.
+    """
+    return re.findall(r'\w+', query or '', re.UNICODE)
+
+
+def searchItems(session, query, category_id=None, limit=20, offset=0):
+    """
+    This returns up to limit items matching every word of query, best match
+    first, each with its category loaded.  category_id narrows the search to
+    one category.
+    """
+    terms = searchTerms(query)
+    if not terms:
+        return []
+    results = session.query(Item).join(Item.category)\
+        .options(contains_eager(Item.category))
+    if session.get_bind().dialect.name == 'sqlite':
+        # Quoting every word turns the query into an implicit AND of
+        # literal terms.
+        match = ' '.join('"%s"' % term for term in terms)
+        matches = text('item_search MATCH :match').bindparams(match=match)
+        rank = literal_column('item_search.rank')
+        results = results.join(item_search, item_search.c.rowid == Item.id)\
+            .filter(matches).order_by(rank, Item.id)
+    else:
+        tsquery = func.plainto_tsquery('english', ' '.join(terms))
+        vector = literal_column(SEARCH_VECTOR_SQL)
+        results = results.filter(vector.op('@@')(tsquery))\
+            .order_by(desc(func.ts_rank_cd(vector, tsquery)), Item.id)
+    if category_id is not None:
+        results = results.filter(Item.category_id == category_id)
+    return results.limit(limit).offset(offset).all()
+
+
+def syncSearchIndex(session, item, deleted=False):
+    """
+    This brings the search index up to date with a written item, in the
+    same transaction as the write.  The Postgres index is built over an
+    expression of the item row, so only SQLite needs any work.
+    """
+    if session.get_bind().dialect.name != 'sqlite':
+        return
+    session.execute(text('DELETE FROM item_search WHERE rowid = :id'),
+                    {'id': item.id})
+    if not deleted:
+        session.execute(text('INSERT INTO item_search (rowid, name, '
+                             'description) VALUES (:id, :name, :description)'),
+                        {'id': item.id, 'name': item.name,
+                         'description': item.description})
+
+
+def rebuildSearchIndex(conn):
+    """
+    This refills the SQLite search table from scratch.
+    """
+    if conn.dialect.name != 'sqlite':
+        return
+    conn.execute(text('DELETE FROM item_search'))
+    conn.execute(text('INSERT INTO item_search (rowid, name, description) '
+                      'SELECT id, name, description FROM item'))
+
+
+def reindexItems(conn, keys):
+    """
+    This rebuilds the SQLite search rows of the items with the given
+    (category_id, name) keys, for writers that bypass the ORM such as the
+    bulk loader.
+    """
+    if conn.dialect.name != 'sqlite' or not keys:
+        return
+    params = [{'category_id': category_id, 'name': name}
+              for category_id, name in keys]
+    conn.execute(text('DELETE FROM item_search WHERE rowid = '
+                      '(SELECT id FROM item WHERE category_id = :category_id '
+                      'AND name = :name)'), params)
+    conn.execute(text('INSERT INTO item_search (rowid, name, description) '
+                      'SELECT id, name, description FROM item '
+                      'WHERE category_id = :category_id AND name = :name'),
+                 params)
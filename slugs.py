@@ -0,0 +1,88 @@
+import re
+import unicodedata
+from sqlalchemy import or_, select
+from database_setup import Category, Item
+
+# Words the routes use as path segments next to a slug, e.g.
+# /catalog/<category>/add/ and /catalog/<category>/<item>/edit/.  A name
+# that slugifies to one of them is suffixed as if the slug were taken.
+RESERVED_SLUGS = frozenset(['add', 'delete', 'edit', 'items', 'json'])
+
+
+def slugify(name, kind):
+    """
+    This returns the URL form of a name: lower case ASCII words joined by
+    hyphens, e.g. "Labrador Retriever" becomes "labrador-retriever".  kind
+    ("category" or "item") stands in for names with no usable characters and
+    prefixes all-digit names, so a slug can never be mistaken for an id.
+    """
+    if not isinstance(name, type(u'')):
+        name = name.decode('utf-8')
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore')\
+        .decode('ascii')
+    slug = '-'.join(re.findall(r'[a-z0-9]+', name.lower()))[:200]
+    if not slug:
+        return kind
+    if slug.isdigit():
+        return '%s-%s' % (kind, slug)
+    return slug
+
+
+def uniqueSlug(base, taken):
+    """
+    This returns base, or base-2, base-3... if base is already taken or is
+    one of the RESERVED_SLUGS.
+    """
+    slug, number = base, 2
+    while slug in taken or slug in RESERVED_SLUGS:
+        slug = '%s-%d' % (base, number)
+        number += 1
+    return slug
+
+
+def takenSlugs(conn, column, base, *criteria):
+    """
+    This returns the slugs in column that uniqueSlug could collide with for
+    base, among the rows matching criteria (e.g. the item's category).
+    Slugs only contain letters, digits and hyphens, so base needs no LIKE
+    escaping.
+    """
+    query = select([column]).where(or_(column == base,
+                                       column.like(base + '-%')))
+    for criterion in criteria:
+        query = query.where(criterion)
+    return set(slug for (slug,) in conn.execute(query))
+
+
+def categorySlug(conn, category):
+    """
+    This returns a free slug for a category from its name.
+    """
+    base = slugify(category.name, 'category')
+    criteria = []
+    if category.id is not None:
+        criteria.append(Category.id != category.id)
+    return uniqueSlug(base, takenSlugs(conn, Category.slug, base, *criteria))
+
+
+def itemSlug(conn, item):
+    """
+    This returns a slug for an item from its name that is free within the
+    item's category.
+    """
+    base = slugify(item.name, 'item')
+    criteria = [Item.category_id == item.category_id]
+    if item.id is not None:
+        criteria.append(Item.id != item.id)
+    return uniqueSlug(base, takenSlugs(conn, Item.slug, base, *criteria))
+
+
+def keyFilter(model, key):
+    """
+    URLs name categories and items by slug or by numeric id.  Slugs are
+    never all digits, so a digit-only key is always an id.  Either way the
+    filter is answered by a unique index.
+    """
+    if key.isdigit():
+        return model.id == int(key)
+    return model.slug == key
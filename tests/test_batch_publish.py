@@ -0,0 +1,89 @@
+"""
+Checks that renaming items through the batch API re-publishes their pages
+and removes the copies published under their old slugs.
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import publish
+from benchmarks.dataset import generate
+from cache import catalog_cache
+from database import get_engine
+from page_cache import page_cache
+from project import create_app
+
+
+class RecordingPublisher(publish.Publisher):
+    """
+    A Publisher that only records what it is asked to publish, so the test
+    can publish it once the request that scheduled it has finished.
+    """
+
+    def __init__(self, app, directory):
+        publish.Publisher.__init__(self, app, directory)
+        self.scheduled = []
+
+    def schedule(self, paths):
+        self.scheduled.extend(paths)
+
+
+class BatchPublishTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app({'DATABASE_URL': 'sqlite://',
+                               'TESTING': True})
+        self.publisher = RecordingPublisher(self.app, self.directory)
+        self.app.extensions['catalog_publisher'] = self.publisher
+        self.context = self.app.app_context()
+        self.context.push()
+        generate(get_engine(), categories=2, items=10, users=2)
+        catalog_cache.clear()
+        page_cache.clear()
+
+    def tearDown(self):
+        self.context.pop()
+        shutil.rmtree(self.directory)
+
+    def publishPaths(self, paths):
+        # A client without the login cookie, as the publisher uses.
+        client = self.app.test_client()
+        for path in sorted(set(paths)):
+            publish.publishPath(client, self.directory, path)
+
+    def testBatchRenameRemovesOldPublishedPage(self):
+        with get_engine().connect() as conn:
+            item_id, slug, user_id = conn.execute(
+                'SELECT id, slug, user_id FROM item WHERE category_id = 1 '
+                'ORDER BY id LIMIT 1').first()
+        old_paths = publish.itemPaths('category-1', slug)
+        self.publishPaths(old_paths)
+        old_page = publish.filePath(self.directory, old_paths[0])
+        self.assertTrue(os.path.exists(old_page))
+
+        client = self.app.test_client()
+        with client.session_transaction() as login_session:
+            login_session['user_id'] = user_id
+        response = client.post('/api/items/batch', data=json.dumps({
+            'operations': [{'action': 'update', 'id': item_id,
+                            'name': 'Renamed Pet'}]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.get_data().decode('utf-8'))
+        self.assertEqual(result['results'][0]['status'], 200)
+
+        self.assertTrue(set(old_paths) <= set(self.publisher.scheduled))
+        self.publishPaths(self.publisher.scheduled)
+        self.assertFalse(os.path.exists(old_page))
+        new_page = publish.filePath(
+            self.directory, publish.itemPaths('category-1', 'renamed-pet')[0])
+        self.assertTrue(os.path.exists(new_page))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Loads the demo catalog and a UTF-8 CSV file into an in-memory database
+with the bulk loader's portable path.
+
+    python -m unittest discover tests
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from bulkload import BulkLoader, readRows
+from database import make_engine
+from migrations import upgrade
+
+# filldatabase.py loads this file when it is imported, so the path is
+# repeated here.
+DEMO_CATALOG = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'fixtures', 'demo_catalog.jsonl')
+
+
+class BulkLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = make_engine('sqlite://')
+        upgrade(self.engine)
+        self.loader = BulkLoader(self.engine, progress=None)
+        self.loader.load(readRows(DEMO_CATALOG))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        self.engine.dispose()
+
+    def writeCSV(self, text):
+        path = os.path.join(self.directory, 'items.csv')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def item(self, name):
+        with self.engine.connect() as conn:
+            return conn.execute('SELECT slug, description, user_id FROM item '
+                                'WHERE name = ?', (name,)).first()
+
+    def testNonASCIIRows(self):
+        self.assertEqual(self.item(u'Löwchen').slug, 'lowchen')
+        path = self.writeCSV(u'category,name,description\n'
+                             u'Dog,Café Hund,Ein Hund für das Café\n')
+        self.loader.load(readRows(path))
+        item = self.item(u'Café Hund')
+        self.assertEqual(item.slug, 'cafe-hund')
+        self.assertEqual(item.description, u'Ein Hund für das Café')
+
+    def testRowWithoutUserKeepsOwner(self):
+        owner = self.item(u'Pug').user_id
+        self.assertIsNotNone(owner)
+        path = self.writeCSV(u'category,name,description\n'
+                             u'Dog,Pug,A small dog.\n')
+        self.loader.load(readRows(path))
+        item = self.item(u'Pug')
+        self.assertEqual(item.description, u'A small dog.')
+        self.assertEqual(item.user_id, owner)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Renders every view with a query budget against a small generated catalog,
+with ENFORCE_QUERY_BUDGETS on, so a view that starts issuing a query per
+row fails here instead of slowing down in production.
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from benchmarks.dataset import generate
+from cache import catalog_cache
+from database import get_engine
+from page_cache import page_cache
+from project import create_app
+
+
+class QueryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app({'DATABASE_URL': 'sqlite://',
+                               'ENFORCE_QUERY_BUDGETS': True,
+                               'TESTING': True})
+        self.context = self.app.app_context()
+        self.context.push()
+        generate(get_engine(), categories=3, items=60, users=5)
+        # Render from the database, not from an earlier test's pages.
+        catalog_cache.clear()
+        page_cache.clear()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as login_session:
+            login_session['user_id'] = 1
+
+    def tearDown(self):
+        self.context.pop()
+
+    def budgetedPaths(self):
+        return {
+            'catalog.home': '/',
+            'catalog.displayItemsInCategory': '/catalog/category-1/',
+            'catalog.jsonCatalog': '/catalog/category-1/JSON?limit=5',
+            'catalog.displayItemDetails': '/catalog/category-1/%s/',
+            'catalog.jsonItem': '/catalog/category-1/%s/JSON',
+            'catalog.searchCatalog': '/search/?q=loyal',
+            'catalog.jsonSearch': '/search/JSON?q=loyal+hardy',
+            'catalog.jsonItemBatch': '/api/items?ids=1,2,3,4,5'
+                                     '&slugs=category-1/item-1',
+        }
+
+    def firstItemSlug(self):
+        with get_engine().connect() as conn:
+            return conn.execute('SELECT slug FROM item WHERE category_id = 1 '
+                                'ORDER BY id LIMIT 1').scalar()
+
+    def testEveryBudgetedViewIsCovered(self):
+        budgeted = set(endpoint for endpoint, view
+                       in self.app.view_functions.items()
+                       if hasattr(view, 'query_budget'))
+        self.assertEqual(budgeted, set(self.budgetedPaths()))
+
+    def testViewsStayWithinBudget(self):
+        item_slug = self.firstItemSlug()
+        for endpoint, path in sorted(self.budgetedPaths().items()):
+            if '%s' in path:
+                path = path % item_slug
+            # QueryBudgetExceeded propagates out of the test client, since
+            # the app is TESTING.
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200,
+                             '%s returned %d' % (path, response.status_code))
+
+
+if __name__ == '__main__':
+    unittest.main()